@@ -24,7 +24,7 @@ class User {
   factory User.fromJson(Map<String, dynamic> json) {
     return User(
       username: json['username'],
-      password: json['password'],
+      password: json['password'] ?? '',
       name: json['name'],
       profileImage: json['profileImage'],
       role: json['role'] ?? 'user',
@@ -1,4 +1,6 @@
+import 'dart:async';
 import 'dart:convert';
+import 'dart:math';
 import 'dart:typed_data';
 import 'package:web_socket_channel/web_socket_channel.dart';
 import 'dart:io';
@@ -57,15 +59,38 @@ class NoteService {
     channel.sink.close();
   }
 
+  // Сервер ограничивает размер сообщения, поэтому картинка отправляется частями
+  static const int _uploadChunkBytes = 512 * 1024;
+
   static Future<String> uploadImage(Uint8List bytes, String filename) async {
     final channel = _createChannel();
-    final base64img = base64Encode(bytes);
-    final req = jsonEncode({'type': 'note', 'action': 'upload_image', 'image': base64img, 'filename': filename});
-    channel.sink.add(req);
-    final resp = await channel.stream.first;
-    channel.sink.close();
-    final data = jsonDecode(resp);
-    return data['path'] ?? '';
+    final responses = StreamIterator(channel.stream);
+    try {
+      String? uploadId;
+      var offset = 0;
+      while (true) {
+        final end = min(offset + _uploadChunkBytes, bytes.length);
+        final isFinal = end >= bytes.length;
+        final req = <String, dynamic>{
+          'type': 'note',
+          'action': 'upload_image',
+          'chunk': base64Encode(bytes.sublist(offset, end)),
+          'final': isFinal,
+          'filename': filename,
+        };
+        if (uploadId != null) req['uploadId'] = uploadId;
+        channel.sink.add(jsonEncode(req));
+        if (!await responses.moveNext()) return '';
+        final data = jsonDecode(responses.current);
+        if (data['status'] != 'success') return '';
+        if (isFinal) return data['path'] ?? '';
+        uploadId = data['uploadId'];
+        offset = end;
+      }
+    } finally {
+      await responses.cancel();
+      channel.sink.close();
+    }
   }
 
   static Uint8List base64ToBytes(String base64str) {
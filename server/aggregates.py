@@ -0,0 +1,116 @@
+# server/aggregates.py
+# Счётчики для запроса 'stats', которые обновляются при каждом изменении пользователя,
+# а не пересчитываются обходом всех пользователей.
+import json
+
+# Поля пользователя со списками пройденного -> ключ разбивки в ответе stats
+COMPLETION_FIELDS = {
+    'completedNotes': 'notes',
+    'completedTests': 'tests',
+    'completedGestures': 'gestures',
+}
+
+
+def _item_key(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def completion_snapshot(doc):
+    # Вклад одного пользователя в счётчики: множества пройденного по каждому полю
+    if not isinstance(doc, dict):
+        return None
+    snapshot = {}
+    for field in COMPLETION_FIELDS:
+        values = doc.get(field)
+        snapshot[field] = {_item_key(value) for value in values} if isinstance(values, list) else set()
+    return snapshot
+
+
+class UserAggregates:
+    def __init__(self):
+        self.users_count = 0
+        # поле -> id конспекта/теста/жеста -> сколько пользователей его прошли
+        self.counts = {field: {} for field in COMPLETION_FIELDS}
+
+    def rebuild(self, users):
+        self.__init__()
+        for doc in users.values():
+            self.update(None, completion_snapshot(doc))
+
+    def update(self, old, new):
+        # old/new - completion_snapshot пользователя до и после изменения (None - пользователя нет)
+        self.users_count += (new is not None) - (old is not None)
+        for field, counts in self.counts.items():
+            before = old[field] if old is not None else set()
+            after = new[field] if new is not None else set()
+            for value in before - after:
+                counts[value] -= 1
+                if not counts[value]:
+                    del counts[value]
+            for value in after - before:
+                counts[value] = counts.get(value, 0) + 1
+
+    def stats(self):
+        response = {
+            "status": "success",
+            "users_count": self.users_count,
+            # Уникальные конспекты, пройденные хотя бы одним пользователем
+            "completed_notes_count": len(self.counts['completedNotes']),
+        }
+        for field, name in COMPLETION_FIELDS.items():
+            response[f"{name}_completions"] = dict(self.counts[field])
+        return response
+
+
+class AggregatedCollection:
+    # Обёртка над коллекцией пользователей: чтения проходят насквозь,
+    # а каждое изменение пересчитывает вклад затронутых пользователей в UserAggregates
+    def __init__(self, collection, aggregates):
+        self.collection = collection
+        self.aggregates = aggregates
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __contains__(self, key):
+        return key in self.collection
+
+    def __len__(self):
+        return len(self.collection)
+
+    def __getitem__(self, key):
+        return self.collection[key]
+
+    def _snapshot(self, key):
+        return completion_snapshot(self.collection.get(key))
+
+    def put(self, key, doc):
+        old = self._snapshot(key)
+        self.collection.put(key, doc)
+        self.aggregates.update(old, self._snapshot(key))
+        return doc
+
+    def pop(self, key):
+        old = self._snapshot(key)
+        doc = self.collection.pop(key)
+        self.aggregates.update(old, None)
+        return doc
+
+    def rename(self, key, new_key):
+        old = self._snapshot(key)
+        replaced = self._snapshot(new_key)
+        self.collection.rename(key, new_key)
+        self.aggregates.update(old, None)
+        self.aggregates.update(replaced, self._snapshot(new_key))
+
+    def set_field(self, key, field, value):
+        old = self._snapshot(key)
+        self.collection.set_field(key, field, value)
+        self.aggregates.update(old, self._snapshot(key))
+
+    def set_list(self, key, field, values):
+        old = self._snapshot(key)
+        self.collection.set_list(key, field, values)
+        self.aggregates.update(old, self._snapshot(key))
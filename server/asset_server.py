@@ -0,0 +1,141 @@
+# server/asset_server.py
+# HTTP-раздача картинок рядом с WebSocket-сервером.
+#
+# Вместо base64 внутри JSON клиент получает адрес вида
+#   /assets/<хэш содержимого>/<путь к файлу>
+# относительно сервера картинок: http://<хост WebSocket-сервера>:<ASSET_HTTP_PORT> или ASSET_BASE_URL.
+# Адрес не зависит от заголовков клиента, поэтому ответы с ним кэшируются один раз для всех.
+# Хэш в адресе меняется вместе с содержимым файла, поэтому такой ответ кэшируется клиентом
+# навсегда; ETag = хэш, If-None-Match даёт 304, Range - частичную отдачу (206).
+import asyncio
+import hashlib
+import mimetypes
+import os
+
+from aiohttp import web
+
+ASSET_HTTP_HOST = os.environ.get('ASSET_HTTP_HOST', '0.0.0.0')
+ASSET_HTTP_PORT = int(os.environ.get('ASSET_HTTP_PORT', 8766))
+# Публичный адрес сервера картинок; если задан, адреса в ответах абсолютные
+ASSET_BASE_URL = os.environ.get('ASSET_BASE_URL', '')
+# Каталоги, файлы из которых можно отдавать
+ASSET_ROOTS = ('data/gestures', 'data/notes', 'data/images', 'uploads/alphabet')
+
+# Длина хэша содержимого в адресе (hex-символов)
+HASH_LENGTH = 16
+
+
+class AssetIndex:
+    # Хэши содержимого файлов, пересчитываются только при изменении mtime/размера
+    def __init__(self, roots=ASSET_ROOTS):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self._hashes = {}
+        # Путь из документа -> (полный путь, путь в адресе); заполняет prepare()
+        self._paths = {}
+
+    def resolve(self, path):
+        # Путь к файлу внутри разрешённых каталогов или None
+        if not path:
+            return None
+        full_path = os.path.abspath(path)
+        for root in self.roots:
+            if os.path.commonpath([root, full_path]) == root and os.path.isfile(full_path):
+                return full_path
+        return None
+
+    def content_hash(self, full_path):
+        stat = os.stat(full_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(full_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()[:HASH_LENGTH]
+        self._hashes[full_path] = (signature, content_hash)
+        return content_hash
+
+    def _prepare(self, paths):
+        for path in paths:
+            full_path = self.resolve(path)
+            if full_path is not None:
+                self.content_hash(full_path)
+                self._paths[path] = (full_path, os.path.relpath(full_path).replace(os.sep, '/'))
+
+    async def prepare(self, paths):
+        # Файлы читаются и хэшируются в потоке, а не в event loop при сборке ответа;
+        # уже известные пути не проверяются - изменённый файл перехэширует handle_asset
+        missing = {path for path in paths if path and path not in self._paths}
+        if missing:
+            await asyncio.to_thread(self._prepare, missing)
+
+    def url_for(self, path):
+        # Адрес картинки для JSON-ответа по данным prepare(); '' если файла нет или он вне разрешённых каталогов
+        entry = self._paths.get(path)
+        if entry is None:
+            return ''
+        full_path, relative = entry
+        return f"{ASSET_BASE_URL.rstrip('/')}/assets/{self._hashes[full_path][1]}/{relative}"
+
+
+asset_index = AssetIndex()
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+async def handle_asset(request):
+    full_path = asset_index.resolve(request.match_info['path'])
+    if full_path is None:
+        raise web.HTTPNotFound()
+
+    content_hash = await asyncio.to_thread(asset_index.content_hash, full_path)
+    etag = f'"{content_hash}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        # Адрес с актуальным хэшем неизменен; по устаревшему отдаём текущий файл без долгого кэша
+        'Cache-Control': 'public, max-age=31536000, immutable'
+        if request.match_info['hash'] == content_hash else 'no-cache',
+    }
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return web.Response(status=304, headers=headers)
+
+    try:
+        http_range = request.http_range
+    except ValueError:
+        raise web.HTTPRequestRangeNotSatisfiable()
+    # If-Range с другим ETag означает, что у клиента старая версия - отдаём файл целиком
+    if request.headers.get('If-Range') not in (None, etag):
+        http_range = slice(None, None)
+
+    body = await asyncio.to_thread(read_file, full_path)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if http_range.start is None and http_range.stop is None:
+        return web.Response(body=body, content_type=content_type, headers=headers)
+
+    start, stop, _ = http_range.indices(len(body))
+    if start >= stop:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{len(body)}'})
+    headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(body)}'
+    return web.Response(status=206, body=body[start:stop], content_type=content_type, headers=headers)
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def start_asset_server(host=ASSET_HTTP_HOST, port=ASSET_HTTP_PORT):
+    app = web.Application()
+    app.router.add_get('/assets/{hash}/{path:.+}', handle_asset)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
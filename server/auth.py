@@ -1,41 +1,161 @@
+# server/auth.py
+# Хэширование паролей и подписанные токены сессий.
+#
+# Пароль хранится как "scrypt$n$r$p$соль$хэш" (base64). Проверка дорогая намеренно, поэтому
+# сервер выполняет её в пуле потоков и только при входе по паролю: в ответ на вход клиент
+# получает токен сессии и при переподключении присылает его вместо пароля.
+# Старые форматы (открытый текст, sha256 без соли) принимаются при входе и сразу перехэшируются.
+import asyncio
+import base64
+import hashlib
+import hmac
 import json
 import os
-import hashlib
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Параметры scrypt: ~16 МБ памяти и десятки миллисекунд на проверку
+SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('AUTH_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('AUTH_SCRYPT_P', 1))
+# Итерации PBKDF2, если OpenSSL собран без scrypt
+PBKDF2_ITERATIONS = int(os.environ.get('AUTH_PBKDF2_ITERATIONS', 600000))
+# Сколько потоков одновременно считают хэши паролей
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', 2))
+# Время жизни токена сессии (секунды)
+TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 30 * 24 * 3600))
+# Ключ подписи токенов: из AUTH_SECRET или из файла, создаваемого при первом запуске
+AUTH_SECRET_FILE = os.environ.get('AUTH_SECRET_FILE', 'auth_secret.key')
+
+_executor = None
+_secret = None
 
-USERS_FILE = "user_data.json"
 
-# Создаём JSON-файл, если его нет
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, "w") as f:
-        json.dump([], f)
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def load_users():
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
-
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=2)
-
-def register_user(username, password, profile_image=None):
-    users = load_users()
-    if any(u["username"] == username for u in users):
-        return {"status": "error", "message": "Username already exists."}
-    users.append({
-        "username": username,
-        "password": hash_password(password),
-        "profile_image": profile_image
-    })
-    save_users(users)
-    return {"status": "success", "message": "User registered successfully."}
-
-def login_user(username, password):
-    users = load_users()
-    hashed = hash_password(password)
-    for user in users:
-        if user["username"] == username and user["password"] == hashed:
-            return {"status": "success", "user": user}
-    return {"status": "error", "message": "Invalid username or password."}
+    salt = secrets.token_bytes(16)
+    if hasattr(hashlib, 'scrypt'):
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                                maxmem=256 * SCRYPT_N * SCRYPT_R)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}"
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(('scrypt$', 'pbkdf2_sha256$'))
+
+
+def verify_password(stored, password):
+    # (пароль верный, хэш нужно пересчитать в текущем формате)
+    if not isinstance(stored, str) or not isinstance(password, str):
+        return False, False
+    encoded = password.encode('utf-8')
+    if stored.startswith('scrypt$'):
+        _, n, r, p, salt, expected = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        digest = hashlib.scrypt(encoded, salt=_b64decode(salt), n=n, r=r, p=p, maxmem=256 * n * r)
+        return hmac.compare_digest(digest, _b64decode(expected)), (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    if stored.startswith('pbkdf2_sha256$'):
+        _, iterations, salt, expected = stored.split('$')
+        digest = hashlib.pbkdf2_hmac('sha256', encoded, _b64decode(salt), int(iterations))
+        # Пересчёт нужен, если появился scrypt или сменилось число итераций, а не при каждом входе
+        needs_rehash = hasattr(hashlib, 'scrypt') or int(iterations) != PBKDF2_ITERATIONS
+        return hmac.compare_digest(digest, _b64decode(expected)), needs_rehash
+    # sha256 без соли (прежний auth.py) или открытый текст (прежний users.json).
+    # Сохранённый sha256 не сравнивается с паролем как текст - иначе войти можно было бы самим хэшем
+    if is_legacy_sha256(stored):
+        matches = hmac.compare_digest(stored.lower().encode('ascii'), hashlib.sha256(encoded).hexdigest().encode('ascii'))
+    else:
+        matches = hmac.compare_digest(stored.encode('utf-8'), encoded)
+    return matches, True
+
+
+def is_legacy_sha256(stored):
+    return len(stored) == 64 and all(char in '0123456789abcdefABCDEF' for char in stored)
+
+
+async def run_in_auth_pool(fn, *args):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='auth')
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def hash_password_async(password):
+    return await run_in_auth_pool(hash_password, password)
+
+
+async def verify_password_async(stored, password):
+    return await run_in_auth_pool(verify_password, stored, password)
+
+
+def _load_secret():
+    global _secret
+    if _secret is None:
+        secret = os.environ.get('AUTH_SECRET')
+        if secret:
+            _secret = secret.encode('utf-8')
+        elif os.path.exists(AUTH_SECRET_FILE):
+            with open(AUTH_SECRET_FILE, 'rb') as f:
+                _secret = f.read().strip()
+        else:
+            _secret = secrets.token_hex(32).encode('ascii')
+            fd = os.open(AUTH_SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_secret)
+    return _secret
+
+
+def password_stamp(stored):
+    # Отпечаток хэша пароля в токене: смена пароля делает все выданные токены недействительными
+    return hashlib.sha256(str(stored).encode('utf-8')).hexdigest()[:16]
+
+
+def issue_token(username, stored_password, ttl=TOKEN_TTL):
+    now = int(time.time())
+    payload = _b64encode(json.dumps({
+        "sub": username,
+        "iat": now,
+        "exp": now + ttl,
+        "pwd": password_stamp(stored_password),
+    }, separators=(',', ':')).encode('utf-8'))
+    signature = _b64encode(hmac.new(_load_secret(), payload.encode('ascii'), hashlib.sha256).digest())
+    return f"{payload}.{signature}"
+
+
+def read_token(token):
+    # Содержимое токена, если подпись верна и срок не истёк, иначе None
+    # Токен приходит от клиента как есть: сравнение идёт в байтах, чтобы любые символы давали None, а не исключение
+    if not isinstance(token, str) or token.count('.') != 1:
+        return None
+    try:
+        payload, signature = token.encode('utf-8').split(b'.')
+        expected = _b64encode(hmac.new(_load_secret(), payload, hashlib.sha256).digest()).encode('ascii')
+        if not hmac.compare_digest(signature, expected):
+            return None
+        claims = json.loads(_b64decode(payload.decode('ascii')))
+        if not isinstance(claims, dict) or claims.get('exp', 0) < time.time():
+            return None
+    except (UnicodeError, TypeError, ValueError):
+        return None
+    return claims
+
+
+def token_matches(claims, username, stored_password):
+    return claims.get('sub') == username and claims.get('pwd') == password_stamp(stored_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
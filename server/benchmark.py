@@ -0,0 +1,402 @@
+# server/benchmark.py
+# Нагрузочный тест сервера.
+#
+# Запускает server.py на копии данных (во временном каталоге, рабочие файлы не меняются)
+# и на свободных портах, чтобы не попасть в уже работающий сервер, подключает N клиентов
+# и гоняет смесь запросов заданное время. В конце печатает пропускную способность,
+# p50/p95/p99 задержки по видам запросов и CPU/RSS процесса сервера с воркерами.
+#
+#   python benchmark.py --clients 20 --duration 30 --mix mixed
+#   python benchmark.py --mix frames --save-baseline         # сохранить результат как базовый
+#   python benchmark.py --mix frames --compare               # сравнить с базовым, код 1 при регрессии
+#   python benchmark.py --url ws://host:8765 --mix reads     # против уже запущенного сервера
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from frame_protocol import pack_frame
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(SERVER_DIR, 'benchmark_baseline.json')
+# Что копируется во временный каталог сервера
+DATA_FILES = ('users.json', 'gestures.json', 'tests.json', 'alphabet.json', 'notes.json')
+DATA_DIRS = ('data', 'uploads')
+FRAME_GLOBS = ('data/gestures/*.png', 'uploads/alphabet/en/*.png')
+
+# Смеси запросов: вид запроса -> вес
+MIXES = {
+    'frames': {'frame': 1},
+    'reads': {'get_all': 1},
+    'writes': {'update_tests': 1},
+    'bulk': {'gestures': 1},
+    'stats': {'stats': 1},
+    'mixed': {'frame': 10, 'get_all': 4, 'update_tests': 2, 'gestures': 1, 'stats': 1},
+}
+GET_ALL_TYPES = ('gesture', 'test', 'alphabet', 'note')
+
+
+def load_frames():
+    frames = []
+    for pattern in FRAME_GLOBS:
+        for path in sorted(glob.glob(os.path.join(SERVER_DIR, pattern))):
+            with open(path, 'rb') as f:
+                frames.append(f.read())
+    if not frames:
+        raise SystemExit("No PNG frames found in data/gestures or uploads/alphabet/en")
+    return frames
+
+
+class Client:
+    def __init__(self, index, url, frames):
+        self.index = index
+        self.url = url
+        self.frames = frames
+        self.username = f'bench{index}@example.com'
+        self.request_ids = itertools.count(1)
+        self.completed = []
+        self.websocket = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=None)
+        # Пользователь для update_tests; если он уже есть (повторный прогон), сервер просто ответит ошибкой
+        await self.request({"type": "auth", "action": "register", "email": self.username, "password": "bench"})
+
+    async def request(self, message):
+        await self.websocket.send(message if isinstance(message, (str, bytes)) else json.dumps(message))
+        return await self.websocket.recv()
+
+    async def run(self, kind):
+        if kind == 'frame':
+            request_id = next(self.request_ids)
+            await self.request(pack_frame(request_id & 0xFFFFFFFF, self.frames[request_id % len(self.frames)]))
+        elif kind == 'get_all':
+            await self.request({"type": random.choice(GET_ALL_TYPES), "action": "get_all"})
+        elif kind == 'update_tests':
+            self.completed.append(f'bench_test_{len(self.completed) % 50}')
+            await self.request({"type": "user", "action": "update_tests", "username": self.username,
+                                "completedTests": self.completed[-20:]})
+        elif kind == 'gestures':
+            await self.request({"type": "gestures"})
+        elif kind == 'stats':
+            await self.request({"type": "stats"})
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+async def client_loop(client, mix, deadline, latencies, errors):
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    while time.monotonic() < deadline:
+        kind = random.choices(kinds, weights)[0]
+        started = time.perf_counter()
+        try:
+            await client.run(kind)
+        except Exception as e:
+            errors[kind] = errors.get(kind, 0) + 1
+            if isinstance(e, websockets.exceptions.ConnectionClosed):
+                return
+            continue
+        latencies.setdefault(kind, []).append(time.perf_counter() - started)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def process_tree(pid):
+    # pid сервера и всех его потомков (процессы распознавания) по /proc
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def resource_usage(pid):
+    # (процессорное время в секундах, RSS в байтах) для дерева процессов сервера; Linux
+    ticks = os.sysconf('SC_CLK_TCK')
+    page = os.sysconf('SC_PAGE_SIZE')
+    cpu = 0.0
+    rss = 0
+    for current in process_tree(pid):
+        try:
+            with open(f'/proc/{current}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{current}/statm') as f:
+                rss += int(f.read().split()[1]) * page
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, rss
+
+
+class ResourceMonitor:
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._task = None
+        self._cpu_started = 0.0
+        self._started = 0.0
+
+    def start(self):
+        if self.pid is None or not os.path.exists('/proc'):
+            return
+        self._cpu_started, self.peak_rss = resource_usage(self.pid)
+        self._started = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.peak_rss = max(self.peak_rss, resource_usage(self.pid)[1])
+
+    def stop(self):
+        if self._task is None:
+            return {}
+        self._task.cancel()
+        cpu, rss = resource_usage(self.pid)
+        elapsed = time.monotonic() - self._started
+        return {
+            "cpu_seconds": round(cpu - self._cpu_started, 3),
+            "cpu_percent": round((cpu - self._cpu_started) / elapsed * 100, 1) if elapsed else 0.0,
+            "peak_rss_mb": round(max(self.peak_rss, rss) / 1024 / 1024, 1),
+        }
+
+
+def free_ports(count):
+    # Сокеты держатся открытыми, пока выбираются все порты, чтобы ОС не выдала один порт дважды
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket()
+            sockets.append(sock)
+            sock.bind(('127.0.0.1', 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def owns_port(pid, port):
+    # Слушает ли процесс pid TCP-порт port (Linux, по /proc); None, если проверить нельзя
+    inodes = set()
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # 0A - LISTEN
+                    if fields[3] == '0A' and int(fields[1].rsplit(':', 1)[1], 16) == port:
+                        inodes.add(f'socket:[{fields[9]}]')
+        except OSError:
+            continue
+    try:
+        fds = os.listdir(f'/proc/{pid}/fd')
+    except OSError:
+        return None
+    for fd in fds:
+        try:
+            if os.readlink(f'/proc/{pid}/fd/{fd}') in inodes:
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def start_server(workdir, port, asset_port, env_overrides):
+    for name in DATA_FILES:
+        if os.path.exists(os.path.join(SERVER_DIR, name)):
+            shutil.copy2(os.path.join(SERVER_DIR, name), workdir)
+    for name in DATA_DIRS:
+        if os.path.isdir(os.path.join(SERVER_DIR, name)):
+            shutil.copytree(os.path.join(SERVER_DIR, name), os.path.join(workdir, name),
+                            ignore=shutil.ignore_patterns('__pycache__'))
+    env = dict(os.environ, LOG_LEVEL='WARNING', TRANSLATION_BACKEND='stub', METRICS_HTTP_PORT='0',
+               WS_PORT=str(port), ASSET_HTTP_PORT=str(asset_port), **env_overrides)
+    return subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, 'server.py')], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for_server(url, process, port=None, timeout=60):
+    # Для запущенного сервера проверяется, что отвечает именно он, а не другой процесс на том же порту
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"server.py exited with code {process.returncode}")
+        try:
+            async with websockets.connect(url):
+                pass
+        except OSError:
+            await asyncio.sleep(0.2)
+            continue
+        if process is not None:
+            if process.poll() is not None:
+                raise SystemExit(f"server.py exited with code {process.returncode}")
+            if owns_port(process.pid, port) is False:
+                raise SystemExit(f"Port {port} is served by another process, not the started server.py")
+        return
+    raise SystemExit(f"Server did not start within {timeout}s")
+
+
+async def run_benchmark(url, mix, clients, duration, warmup, pid):
+    frames = load_frames()
+    connected = [Client(i, url, frames) for i in range(clients)]
+    await asyncio.gather(*(client.connect() for client in connected))
+
+    if warmup:
+        # Прогрев: воркеры загружают MediaPipe, кэши заполняются; эти замеры не учитываются
+        deadline = time.monotonic() + warmup
+        await asyncio.gather(*(client_loop(client, mix, deadline, {}, {}) for client in connected))
+
+    latencies = {}
+    errors = {}
+    monitor = ResourceMonitor(pid)
+    monitor.start()
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(client_loop(client, mix, deadline, latencies, errors) for client in connected))
+    elapsed = time.monotonic() - started
+    resources = monitor.stop()
+    await asyncio.gather(*(client.close() for client in connected))
+
+    results = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        results[kind] = {
+            "requests": len(values),
+            "errors": errors.get(kind, 0),
+            "throughput_rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "clients": clients,
+        "duration_s": round(elapsed, 1),
+        "total_rps": round(total / elapsed, 1),
+        "requests": results,
+        "resources": resources,
+    }
+
+
+def print_report(name, report):
+    print(f"\n{name}: {report['clients']} clients, {report['duration_s']}s, {report['total_rps']} req/s")
+    print(f"{'request':<14}{'count':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for kind, stats in report['requests'].items():
+        print(f"{kind:<14}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+    resources = report['resources']
+    if resources:
+        print(f"server CPU {resources['cpu_percent']}% ({resources['cpu_seconds']}s), "
+              f"peak RSS {resources['peak_rss_mb']} MB")
+
+
+def compare(name, report, baseline, threshold):
+    # Регрессия: p95 вырос или пропускная способность упала больше чем на threshold
+    regressions = []
+    for kind, stats in report['requests'].items():
+        base = baseline.get('requests', {}).get(kind)
+        if base is None:
+            continue
+        if base['p95_ms'] and stats['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}/{kind}: p95 {base['p95_ms']} -> {stats['p95_ms']} ms")
+        if base['throughput_rps'] and stats['throughput_rps'] < base['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}/{kind}: throughput {base['throughput_rps']} -> {stats['throughput_rps']} req/s")
+    return regressions
+
+
+async def main(args):
+    process = None
+    workdir = None
+    url = args.url
+    port = None
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix='gesture-bench-')
+        env_overrides = dict(value.split('=', 1) for value in args.env)
+        port, asset_port = free_ports(2)
+        process = start_server(workdir, port, asset_port, env_overrides)
+        url = f'ws://127.0.0.1:{port}'
+    try:
+        await wait_for_server(url, process, port)
+        reports = {}
+        for name in args.mix:
+            reports[name] = await run_benchmark(url, MIXES[name], args.clients, args.duration, args.warmup,
+                                                process.pid if process is not None else args.pid)
+            print_report(name, reports[name])
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    status = 0
+    if args.compare:
+        regressions = []
+        for name, report in reports.items():
+            if name in baselines:
+                regressions += compare(name, report, baselines[name], args.threshold)
+            else:
+                print(f"No baseline for '{name}' in {args.baseline}")
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            status = 1
+        else:
+            print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+    if args.save_baseline:
+        baselines.update(reports)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=4)
+        print(f"\nBaseline saved to {args.baseline}")
+    return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test for the gesture WebSocket server')
+    parser.add_argument('--mix', nargs='+', choices=sorted(MIXES), default=['mixed'])
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per mix')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of unmeasured traffic before each mix')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting server.py')
+    parser.add_argument('--pid', type=int, help='server pid for CPU/RSS when --url is used')
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='extra environment for the started server, e.g. RECOGNITION_WORKERS=4')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,117 @@
+# server/frame_protocol.py
+# Бинарный формат кадра для запроса распознавания жеста.
+#
+# Сообщение = заголовок фиксированной длины (little-endian) + данные кадра:
+#   magic      2 байта  b'GF'
+#   version    uint8    PROTOCOL_VERSION
+#   request_id uint32   возвращается клиенту в ответе как "requestId"
+#   language   uint8    индекс в LANGUAGES
+#   codec      uint8    CODEC_*
+#   flags      uint8    FLAG_*
+#   width      uint16   для сырых пикселей; для CODEC_ENCODED может быть 0
+#   height     uint16
+# Данные: JPEG/PNG как есть (CODEC_ENCODED) или пиксели построчно без выравнивания.
+#
+# С флагом FLAG_BATCH сообщение несёт несколько кадров подряд: для CODEC_ENCODED
+# каждый кадр предваряется длиной (uint32), сырые кадры просто идут друг за другом.
+# Сырой кадр больше RAW_FRAME_MAX_PIXELS отклоняется с FrameProtocolError.
+import os
+import struct
+from collections import namedtuple
+
+MAGIC = b'GF'
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('<2sBIBBBHH')
+
+LANGUAGES = ('uk', 'en')
+
+CODEC_ENCODED = 0
+CODEC_BGR = 1
+CODEC_RGB = 2
+CODEC_GRAY = 3
+
+# Количество байт на пиксель для сырых форматов
+CODEC_CHANNELS = {
+    CODEC_BGR: 3,
+    CODEC_RGB: 3,
+    CODEC_GRAY: 1,
+}
+
+# Потоковый режим: сервер обрабатывает только последний пришедший кадр соединения
+FLAG_STREAM = 0x01
+# Пакет кадров для recognize_batch
+FLAG_BATCH = 0x02
+
+FRAME_LENGTH = struct.Struct('<I')
+
+# Наибольший сырой кадр (пикселей); по умолчанию 720p - распознавание всё равно уменьшает кадр.
+# Лимит сообщения WebSocket рассчитан так, чтобы такой кадр в BGR/RGB помещался целиком
+RAW_FRAME_MAX_PIXELS = int(os.environ.get('RAW_FRAME_MAX_PIXELS', 1280 * 720))
+RAW_FRAME_MAX_BYTES = RAW_FRAME_MAX_PIXELS * max(CODEC_CHANNELS.values())
+
+FrameHeader = namedtuple('FrameHeader', ['request_id', 'language', 'codec', 'flags', 'width', 'height'])
+
+
+class FrameProtocolError(ValueError):
+    pass
+
+
+def parse_frame(message):
+    if len(message) < HEADER.size:
+        raise FrameProtocolError("Frame is shorter than header")
+    magic, version, request_id, language, codec, flags, width, height = HEADER.unpack_from(message)
+    if magic != MAGIC:
+        raise FrameProtocolError("Invalid frame magic")
+    if version != PROTOCOL_VERSION:
+        raise FrameProtocolError(f"Unsupported frame protocol version: {version}")
+    if language >= len(LANGUAGES):
+        raise FrameProtocolError(f"Unknown language index: {language}")
+
+    payload = message[HEADER.size:]
+    if codec in CODEC_CHANNELS:
+        if width * height > RAW_FRAME_MAX_PIXELS:
+            raise FrameProtocolError(f"Frame is larger than {RAW_FRAME_MAX_PIXELS} pixels")
+        frame_size = width * height * CODEC_CHANNELS[codec]
+        if flags & FLAG_BATCH:
+            if not frame_size or not payload or len(payload) % frame_size:
+                raise FrameProtocolError("Pixel data size does not match width/height")
+        elif len(payload) != frame_size:
+            raise FrameProtocolError("Pixel data size does not match width/height")
+    elif codec != CODEC_ENCODED:
+        raise FrameProtocolError(f"Unknown codec: {codec}")
+    elif not payload:
+        raise FrameProtocolError("Empty frame")
+
+    return FrameHeader(request_id, LANGUAGES[language], codec, flags, width, height), payload
+
+
+def pack_frame(request_id, payload, language='uk', codec=CODEC_ENCODED, width=0, height=0, flags=0):
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, request_id, LANGUAGES.index(language),
+                       codec, flags, width, height) + payload
+
+
+def split_batch(header, payload):
+    if header.codec in CODEC_CHANNELS:
+        frame_size = header.width * header.height * CODEC_CHANNELS[header.codec]
+        return [payload[i:i + frame_size] for i in range(0, len(payload), frame_size)]
+
+    frames = []
+    offset = 0
+    while offset < len(payload):
+        if offset + FRAME_LENGTH.size > len(payload):
+            raise FrameProtocolError("Truncated frame length")
+        (length,) = FRAME_LENGTH.unpack_from(payload, offset)
+        offset += FRAME_LENGTH.size
+        if not length or offset + length > len(payload):
+            raise FrameProtocolError("Truncated batch frame")
+        frames.append(payload[offset:offset + length])
+        offset += length
+    return frames
+
+
+def pack_batch(request_id, frames, language='uk', codec=CODEC_ENCODED, width=0, height=0):
+    if codec == CODEC_ENCODED:
+        payload = b''.join(FRAME_LENGTH.pack(len(frame)) + frame for frame in frames)
+    else:
+        payload = b''.join(frames)
+    return pack_frame(request_id, payload, language, codec, width, height, FLAG_BATCH)
@@ -0,0 +1,51 @@
+# server/image_cache.py
+import base64
+import os
+from collections import OrderedDict
+
+# Максимальный суммарный размер закодированных изображений в кэше (байт)
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+class ImageCache:
+    # LRU-кэш изображений в base64, ключ - путь к файлу; запись действительна,
+    # пока у файла не изменились mtime и размер
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get_base64(self, path):
+        # Как и раньше, отсутствующий или нечитаемый файл даёт пустую строку
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            self.invalidate(path)
+            return ''
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            self._entries.move_to_end(path)
+            return entry[1]
+
+        try:
+            with open(path, 'rb') as img_file:
+                encoded = base64.b64encode(img_file.read()).decode('utf-8')
+        except OSError:
+            self.invalidate(path)
+            return ''
+
+        self.invalidate(path)
+        if len(encoded) <= self.max_bytes:
+            self._entries[path] = (signature, encoded)
+            self.size += len(encoded)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return encoded
+
+    def invalidate(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[1])
@@ -0,0 +1,269 @@
+# server/image_pipeline.py
+# Приём картинок конспектов и жестов.
+#
+# Загруженная картинка декодируется и проверяется, по хэшу содержимого находится уже принятая копия,
+# а для новой в пуле потоков готовятся уменьшенные варианты:
+#   data/images/<хэш>.<png|jpeg|...>  - оригинал
+#   data/images/<хэш>.display.webp    - для показа, не больше IMAGE_DISPLAY_MAX по длинной стороне
+#   data/images/<хэш>.thumb.webp      - миниатюра для списков
+# В записях хранится путь к варианту для показа (imagePath жеста, imagePaths конспекта)
+# и к миниатюре (thumbnailPath, thumbnailPaths).
+# Картинка больше лимита сообщения WebSocket загружается частями (UploadBuffer).
+# Перевод уже сохранённых картинок на варианты (сервер должен быть остановлен):
+#   python image_pipeline.py
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+log = logging.getLogger('image_pipeline')
+
+IMAGE_DIR = os.environ.get('IMAGE_DIR', 'data/images')
+# Ограничения на загружаемую картинку: размер файла и число пикселей (защита от "бомб")
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('IMAGE_MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 50_000_000))
+IMAGE_FORMATS = {'PNG', 'JPEG', 'WEBP', 'GIF', 'BMP'}
+# Длинная сторона вариантов (пиксели)
+IMAGE_DISPLAY_MAX = int(os.environ.get('IMAGE_DISPLAY_MAX', 1280))
+IMAGE_THUMB_MAX = int(os.environ.get('IMAGE_THUMB_MAX', 320))
+# Формат и качество вариантов
+IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'webp').lower()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+# Сколько картинок обрабатывается одновременно
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# Длина хэша содержимого в имени файла (hex-символов)
+HASH_LENGTH = 24
+DISPLAY_SUFFIX = f'.display.{IMAGE_VARIANT_FORMAT}'
+THUMB_SUFFIX = f'.thumb.{IMAGE_VARIANT_FORMAT}'
+
+_executor = None
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+def variant_paths(content_hash):
+    return {
+        'display': os.path.join(IMAGE_DIR, content_hash + DISPLAY_SUFFIX),
+        'thumbnail': os.path.join(IMAGE_DIR, content_hash + THUMB_SUFFIX),
+    }
+
+
+def is_display_variant(path):
+    if not isinstance(path, str) or not path.endswith(DISPLAY_SUFFIX):
+        return False
+    return os.path.dirname(os.path.abspath(path)) == os.path.abspath(IMAGE_DIR)
+
+
+def thumbnail_for(path):
+    # Миниатюра для варианта для показа; '' для картинок, не прошедших приём
+    if not is_display_variant(path):
+        return ''
+    return os.path.join(IMAGE_DIR, os.path.basename(path)[:-len(DISPLAY_SUFFIX)] + THUMB_SUFFIX)
+
+
+def _write_atomic(path, write):
+    # Одну и ту же картинку могут принимать одновременно - у каждой записи свой временный файл
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _save_variant(image, path, max_side):
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    has_alpha = 'A' in variant.getbands() or 'transparency' in variant.info
+    if IMAGE_VARIANT_FORMAT in ('jpeg', 'jpg') or not has_alpha:
+        variant = variant.convert('RGB')
+    elif variant.mode != 'RGBA':
+        variant = variant.convert('RGBA')
+    _write_atomic(path, lambda tmp_path: variant.save(tmp_path, IMAGE_VARIANT_FORMAT, quality=IMAGE_QUALITY))
+    return variant
+
+
+def ingest_image(data):
+    # Проверка, сохранение оригинала и вариантов; уже принятая картинка не обрабатывается повторно
+    if not data:
+        raise ImageRejected("Empty image")
+    if len(data) > IMAGE_MAX_UPLOAD_BYTES:
+        raise ImageRejected(f"Image is larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
+    content_hash = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    paths = variant_paths(content_hash)
+    if all(os.path.exists(path) for path in paths.values()):
+        return dict(paths, hash=content_hash, deduplicated=True)
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in IMAGE_FORMATS:
+                raise ImageRejected(f"Unsupported image format: {image.format}")
+            if image.width * image.height > IMAGE_MAX_PIXELS:
+                raise ImageRejected(f"Image is larger than {IMAGE_MAX_PIXELS} pixels")
+            original_format = image.format
+            # JPEG декодируется сразу в уменьшенном виде - полный кадр с телефона не нужен
+            image.draft('RGB', (IMAGE_DISPLAY_MAX, IMAGE_DISPLAY_MAX))
+            image.load()
+            # Фото с телефона повёрнуто через EXIF - поворачиваем пиксели, EXIF в вариантах не сохраняется
+            image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImageRejected("Invalid image") from e
+
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    original_path = os.path.join(IMAGE_DIR, f"{content_hash}.{original_format.lower()}")
+    if not os.path.exists(original_path):
+        _write_atomic(original_path, lambda tmp_path: _write_bytes(tmp_path, data))
+    # Миниатюра делается из уже уменьшенного варианта
+    display = _save_variant(image, paths['display'], IMAGE_DISPLAY_MAX)
+    _save_variant(display, paths['thumbnail'], IMAGE_THUMB_MAX)
+    return dict(paths, hash=content_hash, original=original_path, deduplicated=False)
+
+
+def decode_upload(image_data, max_bytes=None):
+    # base64, в том числе data URL ("data:image/png;base64,...")
+    if max_bytes is None:
+        max_bytes = IMAGE_MAX_UPLOAD_BYTES
+    if not isinstance(image_data, str) or not image_data:
+        raise ImageRejected("Image data is required")
+    if image_data.startswith('data:'):
+        image_data = image_data.partition(',')[2]
+    # base64 занимает 4/3 размера картинки - слишком большие данные не декодируем
+    if len(image_data) > max_bytes * 4 // 3 + 4:
+        raise ImageRejected(f"Image is larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
+    try:
+        return base64.b64decode(image_data)
+    except (binascii.Error, ValueError) as e:
+        raise ImageRejected("Invalid base64 image data") from e
+
+
+class UploadBuffer:
+    # Загрузка картинки частями в пределах соединения: upload_image с "chunk" (base64 очередной части),
+    # "uploadId" из ответа на первую часть и "final": true на последней. Соединение собирает
+    # не больше одной картинки; новая загрузка (без uploadId) отменяет незавершённую
+    def __init__(self):
+        self.id = None
+        self.data = bytearray()
+
+    def append(self, upload_id, chunk):
+        if upload_id is None:
+            self.reset()
+            self.id = uuid.uuid4().hex
+        elif upload_id != self.id:
+            raise ImageRejected("Unknown upload")
+        try:
+            self.data += decode_upload(chunk, IMAGE_MAX_UPLOAD_BYTES - len(self.data))
+        except ImageRejected:
+            self.reset()
+            raise
+        if len(self.data) > IMAGE_MAX_UPLOAD_BYTES:
+            self.reset()
+            raise ImageRejected(f"Image is larger than {IMAGE_MAX_UPLOAD_BYTES} bytes")
+        return self.id
+
+    def take(self):
+        data = bytes(self.data)
+        self.reset()
+        return data
+
+    def reset(self):
+        self.id = None
+        self.data = bytearray()
+
+
+def ingest_file(path):
+    with open(path, 'rb') as f:
+        return ingest_image(f.read())
+
+
+async def run_in_image_pool(fn, *args):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='images')
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def ingest_upload(image_data):
+    # Декодирование, проверка и уменьшение идут в пуле потоков, event loop только ждёт результат
+    return await run_in_image_pool(lambda: ingest_image(decode_upload(image_data)))
+
+
+async def backfill(store):
+    # Картинки жестов и конспектов, сохранённые до появления приёма, переводятся на варианты;
+    # исходные файлы остаются на месте
+    gestures = store['gestures']
+    notes = store['notes']
+    sources = {gesture.get('imagePath') for gesture in gestures.values()}
+    for note in notes.values():
+        sources.update(note.get('imagePaths') or [])
+    sources = sorted(path for path in sources if isinstance(path, str) and path and not is_display_variant(path))
+
+    async def convert(path):
+        try:
+            return path, (await run_in_image_pool(ingest_file, path))['display']
+        except (OSError, ImageRejected) as e:
+            log.warning("Image not converted", extra={"fields": {"path": path, "error": str(e)}})
+            return path, path
+
+    converted = dict(await asyncio.gather(*(convert(path) for path in sources)))
+
+    updated = 0
+    for gesture_id, gesture in list(gestures.items()):
+        image_path = converted.get(gesture.get('imagePath'), gesture.get('imagePath'))
+        thumbnail_path = thumbnail_for(image_path)
+        if (image_path, thumbnail_path) != (gesture.get('imagePath'), gesture.get('thumbnailPath', '')):
+            gestures.put(gesture_id, dict(gesture, imagePath=image_path, thumbnailPath=thumbnail_path))
+            updated += 1
+    for note_id, note in list(notes.items()):
+        image_paths = [converted.get(path, path) for path in note.get('imagePaths') or []]
+        thumbnail_paths = [thumbnail_for(path) for path in image_paths]
+        if (image_paths, thumbnail_paths) != (note.get('imagePaths') or [], note.get('thumbnailPaths', [])):
+            notes.put(note_id, dict(note, imagePaths=image_paths, thumbnailPaths=thumbnail_paths))
+            updated += 1
+
+    log.info("Image backfill finished", extra={"fields": {
+        "images": len(sources), "converted": sum(1 for path in sources if converted[path] != path),
+        "records": updated}})
+    return updated
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+if __name__ == '__main__':
+    from server import store, writer
+    from server_logging import setup_logging, shutdown_logging
+
+    async def run():
+        store.load()
+        writer.start()
+        try:
+            await backfill(store)
+        finally:
+            await store.close()
+            shutdown()
+
+    setup_logging()
+    try:
+        asyncio.run(run())
+    finally:
+        shutdown_logging()
@@ -0,0 +1,203 @@
+# server/metrics.py
+# Метрики сервера в текстовом формате Prometheus.
+#
+# Счётчики и гистограммы живут в памяти процесса сервера; их отдаёт HTTP-эндпоинт
+# http://METRICS_HTTP_HOST:METRICS_HTTP_PORT/metrics и запрос {"type": "metrics"} по WebSocket.
+import os
+import time
+
+from aiohttp import web
+
+METRICS_HTTP_HOST = os.environ.get('METRICS_HTTP_HOST', '127.0.0.1')
+# 0 - не поднимать HTTP-эндпоинт (метрики остаются доступны по WebSocket)
+METRICS_HTTP_PORT = int(os.environ.get('METRICS_HTTP_PORT', 9108))
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    # Значение задаётся явно (set/inc) или считывается функцией в момент выгрузки метрик
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self):
+        if self.callback is not None:
+            yield self.name, '', self.callback()
+            return
+        yield from super().samples()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # значения меток -> [счётчики по корзинам..., сумма, количество]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def samples(self):
+        for label_values, entry in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labels + ('le',), label_values + (repr(bound),)), cumulative)
+            yield f'{self.name}_bucket', _format_labels(self.labels + ('le',), label_values + ('+Inf',)), entry[-1]
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum', labels, entry[-2]
+            yield f'{self.name}_count', labels, entry[-1]
+
+    def snapshot(self):
+        # Компактный вид для WebSocket: количество, сумма и среднее по каждому набору меток
+        return {
+            '/'.join(map(str, label_values)) or self.name: {
+                "count": entry[-1],
+                "sum": round(entry[-2], 6),
+                "avg_ms": round(entry[-2] / entry[-1] * 1000, 3) if entry[-1] else 0.0,
+            }
+            for label_values, entry in self._values.items()
+        }
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        snapshot = {}
+        for metric in self.metrics:
+            if isinstance(metric, Histogram):
+                snapshot[metric.name] = metric.snapshot()
+            else:
+                snapshot[metric.name] = {labels or metric.name: value for _, labels, value in metric.samples()}
+        return snapshot
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'gesture_server_requests_total', 'Requests handled, by type and action', ('type', 'action'))
+request_seconds = registry.histogram(
+    'gesture_server_request_seconds', 'Request handling latency, by type and action', ('type', 'action'))
+recognition_stage_seconds = registry.histogram(
+    'gesture_server_recognition_stage_seconds', 'Time spent in each recognition stage inside workers', ('stage',))
+storage_load_seconds = registry.histogram(
+    'gesture_server_storage_load_seconds', 'Collection load time', ('collection',))
+storage_save_seconds = registry.histogram(
+    'gesture_server_storage_save_seconds', 'Data file write time', ('file',))
+active_connections = registry.gauge(
+    'gesture_server_active_connections', 'Open WebSocket connections')
+active_connections.set(0)
+response_cache_requests = registry.counter(
+    'gesture_server_response_cache_requests_total', 'Catalog responses served from the serialized cache', ('result',))
+
+
+def observe_stages(stages):
+    for stage, seconds in stages.items():
+        recognition_stage_seconds.observe(seconds, stage)
+
+
+async def handle_metrics(request):
+    return web.Response(body=registry.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def start_metrics_server(host=METRICS_HTTP_HOST, port=METRICS_HTTP_PORT):
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,520 @@
+# server/recognition.py
+import asyncio
+import base64
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from frame_protocol import CODEC_BGR, CODEC_ENCODED, CODEC_GRAY, CODEC_RGB
+
+log = logging.getLogger('recognition')
+
+# Количество процессов-воркеров и размер очереди кадров, ожидающих распознавания
+RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', os.cpu_count() or 1))
+RECOGNITION_QUEUE_SIZE = int(os.environ.get('RECOGNITION_QUEUE_SIZE', 32))
+# Сессии трекинга: лимит на воркер и время простоя до вытеснения (секунды)
+SESSIONS_PER_WORKER = int(os.environ.get('RECOGNITION_SESSIONS_PER_WORKER', 64))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('RECOGNITION_SESSION_IDLE_TIMEOUT', 60))
+# Максимум кадров в одном запросе recognize_batch; длинную запись клиент отправляет несколькими пакетами
+BATCH_MAX_FRAMES = int(os.environ.get('RECOGNITION_BATCH_MAX_FRAMES', 64))
+# Размер одного кадра пакета (JPEG в base64), под который рассчитан лимит сообщения WebSocket
+BATCH_FRAME_BYTES = int(os.environ.get('RECOGNITION_BATCH_FRAME_BYTES', 48 * 1024))
+# Сколько рук MediaPipe ищет в кадре; все найденные классифицируются одним пакетом
+MAX_NUM_HANDS = int(os.environ.get('RECOGNITION_MAX_HANDS', 1))
+# Кадры больше этого размера (по длинной стороне, пиксели) уменьшаются перед MediaPipe; 0 - не уменьшать
+INFERENCE_MAX_SIDE = int(os.environ.get('RECOGNITION_INFERENCE_MAX_SIDE', 640))
+# В сессиях трекинга в MediaPipe уходит только окрестность руки из прошлого кадра
+ROI_ENABLED = os.environ.get('RECOGNITION_ROI', '1') != '0'
+# Сколько кадров подряд рука должна находиться по всему кадру, прежде чем кадр начнёт обрезаться
+ROI_STABLE_FRAMES = int(os.environ.get('RECOGNITION_ROI_STABLE_FRAMES', 3))
+# Поля вокруг рамки руки (доля её размера с каждой стороны) и минимальный размер области
+# (доля короткой стороны кадра)
+ROI_PADDING = float(os.environ.get('RECOGNITION_ROI_PADDING', 0.75))
+ROI_MIN_SIZE = float(os.environ.get('RECOGNITION_ROI_MIN_SIZE', 0.3))
+
+mp_hands = None
+# Экземпляр для одиночных кадров без сессии
+hands = None
+# session_id -> [Hands, время последнего кадра, HandRoi]; свой набор в каждом процессе-воркере
+sessions = OrderedDict()
+
+
+def init_worker():
+    global mp_hands, hands
+    import mediapipe as mp
+    mp_hands = mp.solutions.hands
+    hands = mp_hands.Hands(static_image_mode=True, max_num_hands=MAX_NUM_HANDS, min_detection_confidence=0.7)
+
+
+def get_session(session_id):
+    now = time.monotonic()
+    # Вытесняем простаивающие сессии (клиент мог отключиться, не закрыв сессию)
+    stale_ids = [sid for sid, (_, last_used, _) in sessions.items()
+                 if sid != session_id and now - last_used >= SESSION_IDLE_TIMEOUT]
+    for sid in stale_ids:
+        close_session(sid)
+    # При переполнении освобождаем место за счёт давно не использованной сессии
+    if session_id not in sessions and len(sessions) >= SESSIONS_PER_WORKER:
+        close_session(next(iter(sessions)))
+
+    if session_id in sessions:
+        session = sessions[session_id]
+        sessions.move_to_end(session_id)
+    else:
+        # Режим трекинга: пока рука в кадре, MediaPipe пропускает детекцию ладони
+        session = [mp_hands.Hands(static_image_mode=False, max_num_hands=MAX_NUM_HANDS, min_detection_confidence=0.7),
+                   now, HandRoi()]
+        sessions[session_id] = session
+    session[1] = now
+    return session[0], session[2]
+
+
+def close_session(session_id):
+    session = sessions.pop(session_id, None)
+    if session is not None:
+        session[0].close()
+
+
+# Локализация жестів
+GESTURE_LABELS = {
+    'uk': {
+        "open_palm": "Привіт",
+        "fist": "Так",
+        "thumbs_up": "Добре",
+        "victory": "Молодець",
+        "pointing": "Вказівний",
+        "rock": "Рок",
+        "unknown": "Невідомо"
+    },
+    'en': {
+        "open_palm": "Hello",
+        "fist": "Yes",
+        "thumbs_up": "Good",
+        "victory": "Well done",
+        "pointing": "Pointing",
+        "rock": "Rock",
+        "unknown": "Unknown"
+    },
+}
+
+# Порядок пальцев в векторе состояний; бит i кода жеста = палец i поднят
+FINGERS = ("thumb", "index", "middle", "ring", "pinky")
+# Суставы (основание, середина, кончик) указательного, среднего, безымянного и мизинца
+FINGER_JOINTS = np.array([[5, 6, 8], [9, 10, 12], [13, 14, 16], [17, 18, 20]])
+FINGER_BITS = 1 << np.arange(len(FINGERS))
+
+
+def classify_finger_states(finger_states):
+    up = {finger for finger, is_up in finger_states.items() if is_up}
+    if len(up) == len(FINGERS):
+        return "open_palm"
+    elif not up:
+        return "fist"
+    elif up == {"thumb"}:
+        return "thumbs_up"
+    elif up == {"index", "middle"}:
+        return "victory"
+    elif up == {"index"}:
+        return "pointing"
+    elif up == {"index", "pinky"}:
+        return "rock"
+    else:
+        return "unknown"
+
+
+# Таблица 5-битный код пальцев -> жест, строится один раз при импорте
+GESTURE_TABLE = np.array([
+    classify_finger_states({finger: bool(code & (1 << i)) for i, finger in enumerate(FINGERS)})
+    for code in range(1 << len(FINGERS))
+])
+
+
+def landmarks_to_array(landmarks):
+    return np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float32)
+
+
+def finger_states(points):
+    # points: (..., 21, 3) -> (..., 5) bool, все пальцы и все руки за один проход
+    thumb = points[..., 4, 0] < points[..., 3, 0]
+    y = points[..., FINGER_JOINTS, 1]
+    fingers = (y[..., 2] < y[..., 1]) & (y[..., 1] < y[..., 0])
+    return np.concatenate([thumb[..., np.newaxis], fingers], axis=-1)
+
+
+def recognize_gestures(points, language='uk'):
+    # points: (N, 21, 3) -> список локализованных названий жестов для N рук
+    codes = finger_states(np.asarray(points)) @ FINGER_BITS
+    labels = GESTURE_LABELS['uk' if language == 'uk' else 'en']
+    return [labels[key] for key in GESTURE_TABLE[codes]]
+
+
+def recognize_gesture(landmarks, language='uk'):
+    if not isinstance(landmarks, np.ndarray):
+        landmarks = landmarks_to_array(landmarks)
+    return recognize_gestures(landmarks[np.newaxis], language)[0]
+
+
+class StageTimer:
+    # Время этапов распознавания внутри воркера; уходит в метрики сервера вместе с результатом
+    def __init__(self):
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def skip(self):
+        self._last = time.perf_counter()
+
+
+def with_stages(result, timer):
+    # Ключ "_stages" снимает RecognitionPool до отправки ответа клиенту
+    result["_stages"] = timer.stages
+    return result
+
+
+class HandRoi:
+    # Область руки для следующего кадра сессии (x0, y0, x1, y1 в пикселях полного кадра).
+    # Область остаётся на месте, пока рука не подойдёт к её краю: каждый сдвиг сбивает
+    # трекинг MediaPipe, который помнит положение руки в координатах прошлого входного изображения
+    def __init__(self):
+        self.region = None
+        self.frame_size = None
+        self.hits = 0
+
+    def region_for(self, width, height):
+        if self.region is None or self.frame_size != (width, height):
+            return None
+        return self.region
+
+    def reset(self):
+        self.region = None
+        self.hits = 0
+
+    def update(self, points, width, height):
+        # points: (N, 21, 3), нормализованные координаты полного кадра; None - руки нет
+        if points is None or not ROI_ENABLED:
+            self.reset()
+            return
+        self.hits += 1
+        if self.hits < ROI_STABLE_FRAMES:
+            return
+        x0, x1 = points[..., 0].min() * width, points[..., 0].max() * width
+        y0, y1 = points[..., 1].min() * height, points[..., 1].max() * height
+        margin = max(x1 - x0, y1 - y0) * ROI_PADDING / 2
+        if self.region_for(width, height) is not None:
+            rx0, ry0, rx1, ry1 = self.region
+            if x0 - margin >= rx0 and y0 - margin >= ry0 and x1 + margin <= rx1 and y1 + margin <= ry1:
+                return
+        # Квадратная область с полями вокруг руки, прижатая к границам кадра
+        side = max(x1 - x0, y1 - y0) * (1 + 2 * ROI_PADDING)
+        side = int(min(max(side, ROI_MIN_SIZE * min(width, height)), width, height))
+        left = int(min(max((x0 + x1 - side) / 2, 0), width - side))
+        top = int(min(max((y0 + y1 - side) / 2, 0), height - side))
+        self.region = (left, top, left + side, top + side)
+        self.frame_size = (width, height)
+
+
+def prepare_frame(frame, conversion=None, region=None, timer=None):
+    # Вход MediaPipe: область region кадра, уменьшенная до INFERENCE_MAX_SIDE и переведённая в RGB.
+    # Обрезка и уменьшение идут до перевода цвета, чтобы cvtColor не проходил по всему кадру
+    timer = timer or StageTimer()
+    if region is not None:
+        x0, y0, x1, y1 = region
+        frame = frame[y0:y1, x0:x1]
+    height, width = frame.shape[:2]
+    if INFERENCE_MAX_SIDE and max(height, width) > INFERENCE_MAX_SIDE:
+        scale = INFERENCE_MAX_SIDE / max(height, width)
+        # INTER_LINEAR: на 4K-кадре в ~15 раз быстрее INTER_AREA, а MediaPipe всё равно
+        # пересэмплирует вход билинейно до 192-224 пикселей
+        frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_LINEAR)
+        timer.mark('resize')
+    if conversion is not None:
+        frame = cv2.cvtColor(frame, conversion)
+        timer.mark('cvt_color')
+    return np.ascontiguousarray(frame)
+
+
+def to_frame_coordinates(points, region, width, height):
+    # Точки из нормализованных координат области в нормализованные координаты полного кадра
+    # (z у MediaPipe в масштабе ширины входного изображения)
+    x0, y0, x1, y1 = region
+    mapped = points.copy()
+    mapped[..., 0] = (points[..., 0] * (x1 - x0) + x0) / width
+    mapped[..., 1] = (points[..., 1] * (y1 - y0) + y0) / height
+    mapped[..., 2] = points[..., 2] * (x1 - x0) / width
+    return mapped
+
+
+def find_hands(tracker, image_rgb, timer):
+    results = tracker.process(image_rgb)
+    timer.mark('hands_process')
+    if not results.multi_hand_landmarks:
+        return None
+    return np.array([landmarks_to_array(hand.landmark) for hand in results.multi_hand_landmarks])
+
+
+def track_hands(tracker, frame, conversion=None, roi=None, timer=None):
+    # Точки рук (N, 21, 3) в нормализованных координатах полного кадра или None.
+    # С roi кадр обрезается по руке из прошлых кадров; потерянная рука ищется по всему кадру
+    timer = timer or StageTimer()
+    timer.skip()
+    height, width = frame.shape[:2]
+    region = roi.region_for(width, height) if roi is not None else None
+    points = None
+    if region is not None:
+        image_rgb = prepare_frame(frame, conversion, region, timer)
+        points = find_hands(tracker, image_rgb, timer)
+        if points is None:
+            # Трекер мог потерять руку из-за сдвига области; повторный проход по тому же
+            # изображению уже начинается с поиска ладони
+            points = find_hands(tracker, image_rgb, timer)
+        if points is not None:
+            points = to_frame_coordinates(points, region, width, height)
+    if points is None:
+        points = find_hands(tracker, prepare_frame(frame, conversion, None, timer), timer)
+    if roi is not None:
+        roi.update(points, width, height)
+    return points
+
+
+def classify_hands(points, language='uk', timer=None):
+    timer = timer or StageTimer()
+    timer.skip()
+    if points is None:
+        return {"gesture": "No Hand"}
+    gestures = recognize_gestures(points, language)
+    timer.mark('classification')
+    result = {"gesture": gestures[0]}
+    if len(gestures) > 1:
+        result["gestures"] = gestures
+    return result
+
+
+def process_frame(frame, language='uk', session_id=None):
+    return process_pixels(frame, cv2.COLOR_BGR2RGB, language, session_id)
+
+
+def process_pixels(frame, conversion=None, language='uk', session_id=None, timer=None):
+    # Одиночные кадры (без сессии) только уменьшаются: обрезка по руке нужна непрерывность кадров
+    timer = timer or StageTimer()
+    tracker, roi = (hands, None) if session_id is None else get_session(session_id)
+    return classify_hands(track_hands(tracker, frame, conversion, roi, timer), language, timer)
+
+
+def decode_frame(payload, codec=CODEC_ENCODED, width=0, height=0, timer=None):
+    # Кадр в исходном цветовом формате и код cv2.cvtColor для перевода в RGB (None - уже RGB);
+    # (None, None), если кадр не удалось декодировать. Цвет переводится в prepare_frame
+    timer = timer or StageTimer()
+    if codec == CODEC_ENCODED:
+        frame = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        timer.mark('imdecode')
+        if frame is None:
+            return None, None
+        return frame, cv2.COLOR_BGR2RGB
+
+    # Сырые пиксели читаются без копирования
+    pixels = np.frombuffer(payload, np.uint8)
+    if codec == CODEC_RGB:
+        return pixels.reshape(height, width, 3), None
+    if codec == CODEC_BGR:
+        return pixels.reshape(height, width, 3), cv2.COLOR_BGR2RGB
+    if codec == CODEC_GRAY:
+        return pixels.reshape(height, width), cv2.COLOR_GRAY2RGB
+    return None, None
+
+
+def recognize_frame(payload, codec=CODEC_ENCODED, width=0, height=0, language='uk', session_id=None, timer=None):
+    # Выполняется в процессе-воркере: декодирование кадра тоже уходит из event loop
+    timer = timer or StageTimer()
+    frame, conversion = decode_frame(payload, codec, width, height, timer)
+    if frame is None:
+        return with_stages({"gesture": "Error decoding frame"}, timer)
+    return with_stages(process_pixels(frame, conversion, language, session_id, timer), timer)
+
+
+def recognize_image(image, language='uk', session_id=None):
+    timer = StageTimer()
+    payload = base64.b64decode(image)
+    timer.mark('base64_decode')
+    return recognize_frame(payload, CODEC_ENCODED, 0, 0, language, session_id, timer)
+
+
+def recognize_batch(frames, codec=CODEC_ENCODED, width=0, height=0, language='uk'):
+    # Подряд идущие кадры записи: отдельный трекер на весь отрезок, чтобы работал режим трекинга.
+    # Строки считаются base64 (JSON-запрос), bytes - данными кадра из бинарного сообщения
+    tracker = mp_hands.Hands(static_image_mode=False, max_num_hands=MAX_NUM_HANDS, min_detection_confidence=0.7)
+    roi = HandRoi()
+    results = []
+    try:
+        for payload in frames:
+            timer = StageTimer()
+            started = time.perf_counter()
+            try:
+                if isinstance(payload, str):
+                    payload = base64.b64decode(payload)
+                    timer.mark('base64_decode')
+                frame, conversion = decode_frame(payload, codec, width, height, timer)
+            except Exception:
+                frame = None
+            decoded = time.perf_counter()
+
+            if frame is None:
+                result = {"gesture": "Error decoding frame"}
+            else:
+                result = classify_hands(track_hands(tracker, frame, conversion, roi, timer), language, timer)
+            finished = time.perf_counter()
+
+            result["timings"] = {
+                "decode_ms": round((decoded - started) * 1000, 3),
+                "recognition_ms": round((finished - decoded) * 1000, 3),
+            }
+            results.append(with_stages(result, timer))
+    finally:
+        tracker.close()
+    return results
+
+
+class RecognitionQueueFull(Exception):
+    pass
+
+
+class RecognitionSession:
+    # Привязка соединения к воркеру: все кадры одного клиента идут в один трекер
+    def __init__(self, session_id):
+        self.id = session_id
+        self.worker = None
+        # Поколение процесса воркера: после перезапуска воркера трекера сессии в нём уже нет
+        self.generation = None
+
+
+class RecognitionPool:
+    def __init__(self, workers=RECOGNITION_WORKERS, queue_size=RECOGNITION_QUEUE_SIZE, observe_stages=None):
+        self.workers = max(1, workers)
+        # Получает {этап: секунды} для каждого распознанного кадра
+        self.observe_stages = observe_stages
+        self.queue_size = max(0, queue_size)
+        self.pending = 0
+        self._executors = []
+        self._sessions_per_worker = [0] * self.workers
+        self._generations = [0] * self.workers
+        self._session_ids = itertools.count(1)
+        self._next_worker = itertools.cycle(range(self.workers))
+
+    def start(self):
+        if not self._executors:
+            # По одному процессу на executor, чтобы сессию можно было закрепить за воркером
+            self._executors = [self._new_executor() for _ in range(self.workers)]
+
+    def _new_executor(self):
+        # spawn: воркеры не наследуют состояние event loop и сокетов родителя
+        context = multiprocessing.get_context('spawn')
+        return ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=init_worker)
+
+    def _replace_worker(self, worker, executor):
+        # Процесс воркера упал: executor навсегда остаётся сломанным, поэтому заменяем его новым.
+        # Закреплённые за воркером сессии потеряли трекеры и заново распределятся по воркерам
+        if self._executors[worker] is not executor:
+            return
+        log.error("Recognition worker died, restarting it", extra={"fields": {"worker": worker}})
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._executors[worker] = self._new_executor()
+        self._generations[worker] += 1
+        self._sessions_per_worker[worker] = 0
+
+    def _pinned(self, session):
+        return session.worker is not None and session.generation == self._generations[session.worker]
+
+    def open_session(self):
+        return RecognitionSession(next(self._session_ids))
+
+    def close_session(self, session):
+        if not self._pinned(session):
+            session.worker = None
+            return
+        self._sessions_per_worker[session.worker] -= 1
+        if self._executors:
+            try:
+                self._executors[session.worker].submit(close_session, session.id)
+            except BrokenProcessPool:
+                # Трекер умер вместе с процессом; executor заменит следующий запрос к воркеру
+                pass
+        session.worker = None
+
+    async def recognize(self, image, language='uk', session=None):
+        return await self._run(session, recognize_image, image, language)
+
+    async def recognize_frame(self, header, payload, session=None):
+        return await self._run(session, recognize_frame, payload, header.codec,
+                               header.width, header.height, header.language)
+
+    async def recognize_batch(self, frames, codec=CODEC_ENCODED, width=0, height=0, language='uk'):
+        # Кадры делятся на непрерывные отрезки по числу воркеров и обрабатываются параллельно
+        if not frames:
+            return []
+        chunk_size = -(-len(frames) // self.workers)
+        chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+        if self.pending + len(chunks) > self.workers + self.queue_size:
+            raise RecognitionQueueFull()
+        self.start()
+
+        chunk_results = await asyncio.gather(*[
+            self._submit(worker, recognize_batch, chunk, codec, width, height, language)
+            for worker, chunk in enumerate(chunks)
+        ])
+        return [self._take_stages(result) for chunk in chunk_results for result in chunk]
+
+    async def _run(self, session, fn, *args):
+        # Кадры сверх workers + queue_size отклоняются сразу, а не копятся в памяти
+        if self.pending >= self.workers + self.queue_size:
+            raise RecognitionQueueFull()
+        self.start()
+
+        if session is None:
+            worker = next(self._next_worker)
+            session_id = None
+        else:
+            if not self._pinned(session):
+                # Трекер создаётся лениво на наименее загруженном воркере
+                session.worker = min(range(self.workers), key=self._sessions_per_worker.__getitem__)
+                session.generation = self._generations[session.worker]
+                self._sessions_per_worker[session.worker] += 1
+            worker = session.worker
+            session_id = session.id
+
+        return self._take_stages(await self._submit(worker, fn, *args, session_id))
+
+    def _take_stages(self, result):
+        stages = result.pop("_stages", None)
+        if stages and self.observe_stages is not None:
+            self.observe_stages(stages)
+        return result
+
+    async def _submit(self, worker, fn, *args):
+        self.pending += 1
+        executor = self._executors[worker]
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # Этот кадр потерян (возможно, он и уронил процесс), следующие пойдут в новый процесс
+            self._replace_worker(worker, executor)
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = []
@@ -0,0 +1,88 @@
+# server/response_cache.py
+# Готовые ответы на запросы каталога (get_all, 'gestures').
+#
+# Такой ответ зависит только от версии коллекции и параметров запроса, поэтому он сериализуется
+# один раз на версию и одни и те же байты уходят всем клиентам, пока коллекция не изменится.
+# Клиент, приславший "encoding": "deflate", получает большие ответы бинарным кадром в формате zlib;
+# сжатая копия тоже создаётся один раз на версию.
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+from metrics import response_cache_requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Максимальный суммарный размер сериализованных ответов в кэше (байт)
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Ответы меньше этого размера не сжимаются: выигрыш не окупает распаковку на клиенте
+RESPONSE_DEFLATE_MIN = int(os.environ.get('RESPONSE_DEFLATE_MIN', 4096))
+RESPONSE_DEFLATE_LEVEL = int(os.environ.get('RESPONSE_DEFLATE_LEVEL', 6))
+
+
+def dumps(obj):
+    # JSON в байтах UTF-8; orjson, если установлен
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    # Ошибка разбора в обоих случаях - json.JSONDecodeError (orjson.JSONDecodeError от него наследуется)
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Payload:
+    # Сериализованный ответ; сжатая копия создаётся при первом запросе клиента с "encoding": "deflate"
+    __slots__ = ('data', '_deflated')
+
+    def __init__(self, data):
+        self.data = data
+        self._deflated = None
+
+    @property
+    def deflated(self):
+        if self._deflated is None:
+            self._deflated = zlib.compress(self.data, RESPONSE_DEFLATE_LEVEL)
+        return self._deflated
+
+
+class ResponseCache:
+    # LRU-кэш ответов, ключ - коллекция и параметры запроса; запись действительна,
+    # пока не изменилась версия коллекции. Размер считается по несжатым данным
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, version, build):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            response_cache_requests.inc('hit')
+            return entry[1]
+
+        response_cache_requests.inc('miss')
+        payload = Payload(dumps(build()))
+        self.invalidate(key)
+        if len(payload.data) <= self.max_bytes:
+            self._entries[key] = (version, payload)
+            self.size += len(payload.data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted.data)
+        return payload
+
+    def invalidate(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1].data)
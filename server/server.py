@@ -1,175 +1,270 @@
 # server/server.py
 import asyncio
 import websockets
-import base64
-import cv2
-import numpy as np
+import functools
 import json
-import hashlib
+import logging
 import os
+import signal
+import time
 import uuid
 from datetime import datetime
-from deep_translator import GoogleTranslator
-
-# Путь к файлам данных
-USER_DATA_FILE = 'users.json'
-GESTURES_DATA_FILE = 'gestures.json'
-TESTS_DATA_FILE = 'tests.json'
-ALPHABET_DATA_FILE = 'alphabet.json'
-NOTES_DATA_FILE = 'notes.json'
-
-# Инициализация MediaPipe Hands
-import mediapipe as mp
-mp_hands = mp.solutions.hands
-mp_drawing = mp.solutions.drawing_utils
-hands = mp_hands.Hands(static_image_mode=False, max_num_hands=1, min_detection_confidence=0.7)
-
-def load_json_file(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-def save_json_file(file_path, data):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def recognize_gesture(landmarks, language='uk'):
-    def is_finger_up(start_idx, mid_idx, end_idx):
-        return landmarks[end_idx].y < landmarks[mid_idx].y < landmarks[start_idx].y
-
-    finger_states = {
-        "thumb": landmarks[4].x < landmarks[3].x,
-        "index": is_finger_up(5, 6, 8),
-        "middle": is_finger_up(9, 10, 12),
-        "ring": is_finger_up(13, 14, 16),
-        "pinky": is_finger_up(17, 18, 20),
+from aggregates import AggregatedCollection, UserAggregates
+import auth
+from auth import hash_password, hash_password_async, issue_token, read_token, token_matches, verify_password_async
+from asset_server import ASSET_HTTP_PORT, asset_index, start_asset_server
+from frame_protocol import (CODEC_ENCODED, FLAG_BATCH, FLAG_STREAM, HEADER, RAW_FRAME_MAX_BYTES, FrameProtocolError,
+                            parse_frame, split_batch)
+from image_cache import ImageCache
+import image_pipeline
+from image_pipeline import ImageRejected, UploadBuffer, ingest_image, ingest_upload, run_in_image_pool, thumbnail_for
+from metrics import (METRICS_HTTP_HOST, METRICS_HTTP_PORT, active_connections, observe_stages, registry,
+                     request_seconds, requests_total, start_metrics_server)
+from response_cache import RESPONSE_DEFLATE_MIN, Payload, ResponseCache, dumps, loads
+from recognition import BATCH_FRAME_BYTES, BATCH_MAX_FRAMES, RecognitionPool, RecognitionQueueFull
+from server_logging import Sampler, preview, setup_logging, shutdown_logging, summarize_request
+from storage import (ALPHABET_DATA_FILE, COLLECTION_FILES, GESTURES_DATA_FILE, JOURNALED_COLLECTIONS, NOTES_DATA_FILE,
+                     SYNCED_COLLECTIONS, TESTS_DATA_FILE, DocumentStore, WriteBehindWriter, save_json_file)
+from streaming import FrameStream
+from translation import NOTE_TRANSLATED_FIELDS, NoteTranslator, translate_note
+from user_registry import UserRegistry
+
+log = logging.getLogger('server')
+# Кадры камеры журналируются выборочно: один из LOG_FRAME_SAMPLE
+frame_log_sampler = Sampler()
+
+# Порт WebSocket-сервера
+WS_PORT = int(os.environ.get('WS_PORT', 8765))
+# Сжатие permessage-deflate на соединениях: 'deflate' или 'none'. С 'none' ответы каталога,
+# заранее сжатые для клиентов с "encoding": "deflate", не сжимаются повторно на каждом соединении
+WS_COMPRESSION = os.environ.get('WS_COMPRESSION', 'deflate')
+# Максимальный размер входящего сообщения (байт), общий для всех соединений и запросов.
+# По умолчанию вмещает recognize_batch из BATCH_MAX_FRAMES кадров по BATCH_FRAME_BYTES и наибольший
+# сырой кадр; картинки больше лимита загружаются частями. Сообщение больше лимита закрывает соединение (1009)
+WS_MAX_MESSAGE_BYTES = int(os.environ.get('WS_MAX_MESSAGE_BYTES', max(
+    BATCH_MAX_FRAMES * BATCH_FRAME_BYTES, HEADER.size + RAW_FRAME_MAX_BYTES) + 64 * 1024))
+# Сколько принятых сообщений соединения может ждать обработки; вместе с лимитом размера
+# ограничивает память, которую занимает один клиент
+WS_MAX_QUEUE = int(os.environ.get('WS_MAX_QUEUE', 4))
+
+def websocket_serve_options():
+    return {
+        "compression": None if WS_COMPRESSION == 'none' else WS_COMPRESSION,
+        "max_size": WS_MAX_MESSAGE_BYTES,
+        "max_queue": WS_MAX_QUEUE,
     }
 
-    # Локализация жестів
-    gestures_uk = {
-        "open_palm": "Привіт",
-        "fist": "Так",
-        "thumbs_up": "Добре",
-        "victory": "Молодець",
-        "pointing": "Вказівний",
-        "rock": "Рок",
-        "unknown": "Невідомо"
-    }
-    gestures_en = {
-        "open_palm": "Hello",
-        "fist": "Yes",
-        "thumbs_up": "Good",
-        "victory": "Well done",
-        "pointing": "Pointing",
-        "rock": "Rock",
-        "unknown": "Unknown"
+# Распознавание жестов выполняется в пуле процессов, event loop только ждёт результат
+recognition_pool = RecognitionPool(observe_stages=observe_stages)
+
+# Изменения данных сбрасываются на диск в фоне, атомарно и пачками
+writer = WriteBehindWriter()
+
+# Картинки жестов в base64
+image_cache = ImageCache()
+# Сериализованные ответы get_all и 'gestures' по версии коллекции: один json.dumps на версию, а не на клиента
+response_cache = ResponseCache()
+# Версия коллекции, для картинок которой уже посчитаны хэши адресов (asset_index.prepare)
+asset_versions = {}
+
+# Перевод конспектов: кэш + пул потоков, чтобы сетевой запрос не блокировал event loop
+translator = NoteTranslator(writer=writer)
+# Фоновые переводы конспектов по id; новое изменение конспекта отменяет незавершённый перевод
+note_translation_tasks = {}
+
+# Коллекции загружаются один раз при старте; бэкенд (json/sqlite) задаёт STORAGE_BACKEND
+store = DocumentStore(COLLECTION_FILES, writer, JOURNALED_COLLECTIONS, revisioned=SYNCED_COLLECTIONS)
+
+# Счётчики для 'stats' ведутся при каждом изменении пользователей, поэтому все изменения идут через реестр
+user_aggregates = UserAggregates()
+user_registry = UserRegistry(AggregatedCollection(store['users'], user_aggregates))
+
+# Глубина очередей считывается в момент выгрузки метрик
+registry.gauge('gesture_server_recognition_pending', 'Frames submitted to recognition workers and not finished yet',
+               callback=lambda: recognition_pool.pending)
+registry.gauge('gesture_server_storage_dirty_files', 'Data files waiting for the write-behind flush',
+               callback=lambda: writer.dirty_files)
+registry.gauge('gesture_server_translations_in_flight', 'Translations running in the thread pool',
+               callback=lambda: translator.in_flight)
+registry.gauge('gesture_server_note_translation_tasks', 'Notes waiting for background translation',
+               callback=lambda: len(note_translation_tasks))
+registry.gauge('gesture_server_response_cache_bytes', 'Serialized catalog responses held in memory',
+               callback=lambda: response_cache.size)
+
+def get_all_filters(request, fields):
+    # Фильтры get_all отвечаются вторичными индексами коллекции; 'all' или пустое значение - без фильтра
+    return {field: request[field] for field in fields if request.get(field) not in (None, '', 'all')}
+
+def get_all_response(request, name, key, fields, image_urls=False, decorate=None):
+    # Готовый ответ из кэша, пока коллекция не изменилась; decorate дописывает в ответ ссылки на картинки
+    filters = get_all_filters(request, fields)
+    params = tuple(request.get(param) for param in ('since', 'limit', 'cursor'))
+    cache_key = ('get_all', name, image_urls, repr(sorted(filters.items())), repr(params))
+
+    def build():
+        response = build_get_all_response(request, name, key, filters)
+        return decorate(response) if decorate is not None else response
+
+    # Версия читается после refresh(): иначе внешняя правка файла коллекции не попадёт в кэш,
+    # пока какая-нибудь запись не обратится к данным
+    collection = store[name]
+    collection.refresh()
+    return response_cache.get(cache_key, collection.version, build)
+
+async def prepare_assets(name):
+    # Хэши картинок коллекции считаются в потоке один раз на версию коллекции, а не при каждом запросе
+    collection = store[name]
+    collection.refresh()
+    version = collection.version
+    if asset_versions.get(name) != version:
+        await asset_index.prepare([doc.get('imagePath', '') for doc in collection.values()])
+        asset_versions[name] = version
+
+def build_get_all_response(request, name, key, filters):
+    # Без since/limit/cursor - вся коллекция, как раньше. Иначе только изменения после ревизии since
+    # (или продолжение с cursor), не больше limit за раз, плюс id удалённых документов
+    collection = store[name]
+    if all(request.get(param) is None for param in ('since', 'limit', 'cursor')):
+        return {"status": "success", key: collection.find(**filters)}
+
+    try:
+        since = int(request.get('since') or 0)
+        limit = int(request['limit']) if request.get('limit') is not None else None
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "since and limit must be integers"}
+    if limit is not None and limit <= 0:
+        return {"status": "error", "message": "limit must be positive"}
+
+    try:
+        # cursor передаётся так, как пришёл в next_cursor
+        docs, deleted, next_cursor, reset = collection.changes(since, limit, request.get('cursor'), **filters)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "Invalid cursor"}
+    return {
+        "status": "success",
+        key: docs,
+        "deleted": deleted,
+        # Клиент сохраняет revision и передаёт её как since при следующей синхронизации
+        "revision": collection.revision,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        # reset: клиент слишком отстал (или данные на сервере заменены) - локальную копию нужно заменить целиком
+        "reset": reset
     }
-    g = gestures_uk if language == 'uk' else gestures_en
-
-    if all(finger_states.values()):
-        return g["open_palm"]
-    elif not any(finger_states.values()):
-        return g["fist"]
-    elif finger_states["thumb"] and not any([finger_states["index"], finger_states["middle"], finger_states["ring"], finger_states["pinky"]]):
-        return g["thumbs_up"]
-    elif finger_states["index"] and finger_states["middle"] and not any([finger_states["thumb"], finger_states["ring"], finger_states["pinky"]]):
-        return g["victory"]
-    elif finger_states["index"] and not any([finger_states["thumb"], finger_states["middle"], finger_states["ring"], finger_states["pinky"]]):
-        return g["pointing"]
-    elif finger_states["index"] and finger_states["pinky"] and not any([finger_states["thumb"], finger_states["middle"], finger_states["ring"]]):
-        return g["rock"]
-    else:
-        return g["unknown"]
-
-def process_frame(frame, language='uk'):
-    image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = hands.process(image_rgb)
-    if results.multi_hand_landmarks:
-        for hand_landmarks in results.multi_hand_landmarks:
-            gesture = recognize_gesture(hand_landmarks.landmark, language)
-            return gesture
-    return "No Hand"
-
-def translate_note_text(text, src_lang, dest_lang):
-    import re
-    # Найти все [img:N] и заменить на плейсхолдеры
-    img_pattern = re.compile(r'\[img:(\d+)\]')
-    placeholders = []
-    def repl(match):
-        placeholders.append(match.group(0))
-        return f'__IMG_{len(placeholders)-1}__'
-    temp_text = img_pattern.sub(repl, text)
-    # Перевести текст
-    translated = GoogleTranslator(source=src_lang, target=dest_lang).translate(temp_text)
-    # Вернуть плейсхолдеры обратно
-    for idx, ph in enumerate(placeholders):
-        translated = translated.replace(f'__IMG_{idx}__', ph)
-    return translated
 
 # ============== AUTH HANDLERS ==============
-def handle_auth_request(request, users):
+async def handle_auth_request(request, users):
+    # Запросы к одному пользователю из разных соединений выполняются по очереди
+    async with users.lock(request.get('email') or request.get('username')):
+        return await auth_user(request, users)
+
+def user_response(username, users):
+    # Данные пользователя для клиента; пароль (и его хэш) наружу не отдаются
+    user = users[username]
+    return {
+        "username": username,
+        "name": user.get("name", ""),
+        "role": user.get("role", "user"),
+        "profileImage": user.get("photo", ""),
+        "completedTests": user.get("completedTests", []),
+        "completedNotes": user.get("completedNotes", []),
+        "completedGestures": user.get("completedGestures", [])
+    }
+
+async def auth_user(request, users):
     action = request.get('action', 'login')
 
     if action == 'login':
         email = request.get('email') or request.get('username')
         password = request.get('password')
-
-        print(f"Login attempt for: {email}")
-
-        if email in users:
-            if users[email]["password"] == password:
-                response = {
-                    "status": "Login successful",
-                    "user": {
-                        "username": email,
-                        "password": password,
-                        "name": users[email].get("name", ""),
-                        "role": users[email].get("role", "user"),
-                        "profileImage": users[email].get("photo", ""),
-                        "completedTests": users[email].get("completedTests", []),
-                        "completedNotes": users[email].get("completedNotes", []),
-                        "completedGestures": users[email].get("completedGestures", [])
-                    }
-                }
-                print(f"Login successful for {email} (role: {users[email].get('role', 'user')})")
-                return response
-            else:
-                print(f"Invalid password for {email}")
-                return {"status": "Invalid password"}
+        token = request.get('token')
+
+        if password is None and token is not None:
+            # Переподключение по токену сессии: без KDF
+            claims = read_token(token)
+            if claims is None:
+                log.info("Invalid token", extra={"fields": {"user": email}})
+                return {"status": "Invalid token"}
+            email = email or claims.get('sub')
+            if email not in users:
+                log.info("User not found", extra={"fields": {"user": email}})
+                return {"status": "User not found"}
+            stored = users[email].get("password")
+            if not token_matches(claims, email, stored):
+                log.info("Invalid token", extra={"fields": {"user": email}})
+                return {"status": "Invalid token"}
         else:
-            print(f"User not found: {email}")
-            return {"status": "User not found"}
+            log.info("Login attempt", extra={"fields": {"user": email}})
+            if email not in users:
+                log.info("User not found", extra={"fields": {"user": email}})
+                return {"status": "User not found"}
+            stored = users[email].get("password")
+            valid, needs_rehash = await verify_password_async(stored, password)
+            if not valid:
+                log.info("Invalid password", extra={"fields": {"user": email}})
+                return {"status": "Invalid password"}
+            if needs_rehash:
+                # Пароль в открытом виде или в старом формате - сохраняем хэш
+                stored = await hash_password_async(password)
+                users.set_field(email, "password", stored)
+                log.info("Password hash upgraded", extra={"fields": {"user": email}})
+
+        log.info("Login successful", extra={"fields": {"user": email, "role": users[email].get('role', 'user')}})
+        return {
+            "status": "Login successful",
+            "user": user_response(email, users),
+            "token": issue_token(email, stored)
+        }
 
     elif action == 'register':
         email = request.get('email') or request.get('username')
         password = request.get('password')
-        role = request.get('role', 'user')
 
+        if not email or not isinstance(password, str) or not password:
+            return {"status": "error", "message": "Email and password are required"}
         if email in users:
             return {"status": "error", "message": "User already exists"}
 
-        users[email] = {
-            "password": password,
+        stored = await hash_password_async(password)
+        # Пока считался хэш, соединение могло уйти в ожидание - проверяем ещё раз
+        if email in users:
+            return {"status": "error", "message": "User already exists"}
+        users.put(email, {
+            "password": stored,
             "name": request.get("name", email.split('@')[0]),
             "photo": "",
-            "role": role,
+            # Роль из запроса не принимается: иначе любой клиент мог бы зарегистрироваться администратором
+            "role": "user",
             "completedTests": [],
             "completedNotes": request.get("completedNotes", []),
             "completedGestures": request.get("completedGestures", [])
-        }
-        save_json_file(USER_DATA_FILE, users)
-        print(f"User registered: {email}")
+        })
+        log.info("User registered", extra={"fields": {"user": email}})
 
-        return {"status": "success", "message": "User registered successfully"}
+        return {"status": "success", "message": "User registered successfully", "token": issue_token(email, stored)}
 
     return {"status": "error", "message": "Invalid action"}
 
+def is_admin(request, users):
+    # Права проверяются по токену сессии из запроса так же, как при входе по токену
+    claims = read_token(request.get('token'))
+    if claims is None:
+        return False
+    username = claims.get('sub')
+    if not isinstance(username, str) or username not in users:
+        return False
+    user = users[username]
+    return token_matches(claims, username, user.get("password")) and user.get("role") == 'admin'
+
 # ============== USER HANDLERS ==============
-def handle_user_request(request, users):
+async def handle_user_request(request, users):
+    username = request.get('username') or request.get('email')
+    # При переименовании блокируются и старое, и новое имя
+    new_username = (request.get('data') or {}).get('username') if request.get('action') == 'update_profile' else None
+    async with users.lock(username, new_username):
+        return update_user(request, users)
+
+def update_user(request, users):
     action = request.get('action')
 
     if action == 'update_tests':
@@ -177,9 +272,8 @@ def handle_user_request(request, users):
         completed_tests = request.get('completedTests', [])
 
         if username in users:
-            users[username]["completedTests"] = completed_tests
-            save_json_file(USER_DATA_FILE, users)
-            print(f"Updated tests for {username}: {len(completed_tests)} tests")
+            users.set_list(username, "completedTests", completed_tests)
+            log.info("Updated tests", extra={"fields": {"user": username, "tests": len(completed_tests)}})
             return {"status": "success", "message": "Tests updated successfully"}
         else:
             return {"status": "error", "message": "User not found"}
@@ -189,43 +283,32 @@ def handle_user_request(request, users):
         data = request.get('data', {})
 
         if username in users:
-            user_data = users[username]
-
             new_username = data.get('username')
             if new_username and new_username != username:
-                users[new_username] = user_data
-                del users[username]
+                if new_username in users:
+                    return {"status": "error", "message": "User already exists"}
+                users.rename(username, new_username)
                 username = new_username
 
             if 'profileImage' in data:
-                users[username]['photo'] = data['profileImage']
+                users.set_field(username, 'photo', data['profileImage'])
 
             if 'name' in data:
-                users[username]['name'] = data['name']
+                users.set_field(username, 'name', data['name'])
 
             # Обновляем completedNotes, completedGestures, completedTests только если они пришли в data
             for field in ['completedNotes', 'completedGestures', 'completedTests']:
                 if field in data:
-                    users[username][field] = data[field]
+                    users.set_list(username, field, data[field])
                 elif field not in users[username]:
-                    users[username][field] = []
+                    users.set_field(username, field, [])
 
-            save_json_file(USER_DATA_FILE, users)
-            print(f"Profile updated for {username}")
+            log.info("Profile updated", extra={"fields": {"user": username}})
 
             return {
                 "status": "success",
                 "message": "Profile updated successfully",
-                "user": {
-                    "username": username,
-                    "password": users[username]["password"],
-                    "name": users[username].get("name", ""),
-                    "role": users[username].get("role", "user"),
-                    "profileImage": users[username].get("photo", ""),
-                    "completedTests": users[username].get("completedTests", []),
-                    "completedNotes": users[username].get("completedNotes", []),
-                    "completedGestures": users[username].get("completedGestures", [])
-                }
+                "user": user_response(username, users)
             }
         else:
             return {"status": "error", "message": "User not found"}
@@ -234,9 +317,8 @@ def handle_user_request(request, users):
         username = request.get('username') or request.get('email')
 
         if username in users:
-            users[username]["completedTests"] = []
-            save_json_file(USER_DATA_FILE, users)
-            print(f"Tests reset for {username}")
+            users.set_field(username, "completedTests", [])
+            log.info("Tests reset", extra={"fields": {"user": username}})
             return {"status": "success", "message": "Tests reset successfully"}
         else:
             return {"status": "error", "message": "User not found"}
@@ -244,21 +326,15 @@ def handle_user_request(request, users):
     return {"status": "error", "message": "Invalid action"}
 
 # ============== GESTURE HANDLERS ==============
-def handle_gesture_request(request):
+async def handle_gesture_request(request, session=None, uploads=None):
     action = request.get('action')
     language = request.get('language', 'uk')
 
     if action == 'get_all':
-        gestures = load_json_file(GESTURES_DATA_FILE)
-        return {
-            "status": "success",
-            "gestures": list(gestures.values()) if isinstance(gestures, dict) else gestures
-        }
+        return get_all_response(request, 'gestures', 'gestures', ('category', 'groupId'))
 
     elif action == 'create':
-        gestures = load_json_file(GESTURES_DATA_FILE)
-        if not isinstance(gestures, dict):
-            gestures = {}
+        gestures = store['gestures']
 
         gesture_id = str(uuid.uuid4())
         gesture_data = {
@@ -269,9 +345,9 @@ def handle_gesture_request(request):
             "imagePath": request.get('imagePath', ''),
             "created_at": datetime.now().isoformat()
         }
+        gesture_data["thumbnailPath"] = thumbnail_for(gesture_data["imagePath"])
 
-        gestures[gesture_id] = gesture_data
-        save_json_file(GESTURES_DATA_FILE, gestures)
+        gestures.put(gesture_id, gesture_data)
 
         return {
             "status": "success",
@@ -280,11 +356,12 @@ def handle_gesture_request(request):
         }
 
     elif action == 'update':
-        gestures = load_json_file(GESTURES_DATA_FILE)
+        gestures = store['gestures']
         gesture_id = request.get('id')
 
         if gesture_id in gestures:
             gesture_data = gestures[gesture_id]
+            old_image_path = gesture_data.get('imagePath')
             gesture_data.update({
                 "name": request.get('name', gesture_data.get('name')),
                 "description": request.get('description', gesture_data.get('description')),
@@ -292,9 +369,11 @@ def handle_gesture_request(request):
                 "imagePath": request.get('imagePath', gesture_data.get('imagePath')),
                 "updated_at": datetime.now().isoformat()
             })
+            gesture_data["thumbnailPath"] = thumbnail_for(gesture_data.get("imagePath"))
 
-            gestures[gesture_id] = gesture_data
-            save_json_file(GESTURES_DATA_FILE, gestures)
+            gestures.put(gesture_id, gesture_data)
+            if gesture_data.get('imagePath') != old_image_path:
+                image_cache.invalidate(old_image_path)
 
             return {
                 "status": "success",
@@ -305,12 +384,12 @@ def handle_gesture_request(request):
             return {"status": "error", "message": "Gesture not found"}
 
     elif action == 'delete':
-        gestures = load_json_file(GESTURES_DATA_FILE)
+        gestures = store['gestures']
         gesture_id = request.get('id')
 
         if gesture_id in gestures:
             deleted_gesture = gestures.pop(gesture_id)
-            save_json_file(GESTURES_DATA_FILE, gestures)
+            image_cache.invalidate(deleted_gesture.get('imagePath'))
 
             return {
                 "status": "success",
@@ -320,39 +399,92 @@ def handle_gesture_request(request):
         else:
             return {"status": "error", "message": "Gesture not found"}
 
+    elif action == 'upload_image':
+        return await upload_image(request, uploads)
+
+    elif action == 'recognize_batch':
+        frames = request.get('frames', [])
+        if not isinstance(frames, list) or not frames:
+            return {"status": "error", "message": "No frames provided"}
+        return await recognize_gesture_batch(frames, language=language)
+
     # Обработка распознавания жестов (существующий код)
     elif 'image' in request:
         try:
-            img_data = base64.b64decode(request.get('image'))
-            np_arr = np.frombuffer(img_data, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-            if frame is not None:
-                gesture = process_frame(frame, language)
-                return {"gesture": gesture}
-            else:
-                return {"gesture": "Error decoding frame"}
-        except Exception as e:
-            print(f"Error processing gesture: {e}")
+            return await recognition_pool.recognize(request.get('image'), language, session)
+        except RecognitionQueueFull:
+            return {"gesture": "Server busy"}
+        except Exception:
+            log.exception("Error processing gesture")
             return {"gesture": "Error processing image"}
 
     return {"status": "error", "message": "Invalid gesture action"}
 
+async def recognize_gesture_batch(frames, codec=CODEC_ENCODED, width=0, height=0, language='uk'):
+    # Пакет кадров (например, запись тренировки): один ответ с результатом и таймингами на кадр
+    if len(frames) > BATCH_MAX_FRAMES:
+        return {"status": "error", "message": f"Too many frames (max {BATCH_MAX_FRAMES})"}
+
+    started = time.perf_counter()
+    try:
+        results = await recognition_pool.recognize_batch(frames, codec, width, height, language)
+    except RecognitionQueueFull:
+        return {"status": "error", "message": "Server busy"}
+    except Exception:
+        log.exception("Error processing gesture batch")
+        return {"status": "error", "message": "Error processing frames"}
+
+    return {
+        "status": "success",
+        "results": results,
+        "total_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+
+async def handle_gesture_frame(header, payload, session=None):
+    # Бинарный кадр: заголовок frame_protocol + JPEG или сырые пиксели, без JSON и base64
+    try:
+        result = await recognition_pool.recognize_frame(header, payload, session)
+        return {"requestId": header.request_id, **result}
+    except RecognitionQueueFull:
+        return {"requestId": header.request_id, "gesture": "Server busy"}
+    except Exception:
+        log.exception("Error processing gesture frame")
+        return {"requestId": header.request_id, "gesture": "Error processing image"}
+
+async def get_gestures_payload(image_urls=False):
+    # Ответ на 'gestures' сериализуется один раз и отдаётся из памяти, пока коллекция жестов не изменится.
+    # С image_urls вместо imageBase64 в ответе ссылка imageUrl на сервер картинок
+    gestures = store['gestures']
+
+    def build():
+        gesture_list = []
+        for gesture in gestures.values():
+            gesture_copy = dict(gesture)
+            if image_urls:
+                gesture_copy['imageUrl'] = asset_index.url_for(gesture_copy.get('imagePath', ''))
+            else:
+                gesture_copy['imageBase64'] = image_cache.get_base64(gesture_copy.get('imagePath', ''))
+            gesture_list.append(gesture_copy)
+        return {
+            "status": "success",
+            "gestures": gesture_list
+        }
+
+    if image_urls:
+        await prepare_assets('gestures')
+    # Внешняя правка gestures.json подхватывается refresh() до чтения версии
+    gestures.refresh()
+    return response_cache.get(('gestures', image_urls), gestures.version, build)
+
 # ============== TEST HANDLERS ==============
 def handle_test_request(request):
     action = request.get('action')
 
     if action == 'get_all':
-        tests = load_json_file(TESTS_DATA_FILE)
-        return {
-            "status": "success",
-            "tests": list(tests.values()) if isinstance(tests, dict) else tests
-        }
+        return get_all_response(request, 'tests', 'tests', ('category', 'groupId'))
 
     elif action == 'create':
-        tests = load_json_file(TESTS_DATA_FILE)
-        if not isinstance(tests, dict):
-            tests = {}
+        tests = store['tests']
 
         test_id = str(uuid.uuid4())
         test_data = {
@@ -365,8 +497,7 @@ def handle_test_request(request):
             "created_at": datetime.now().isoformat()
         }
 
-        tests[test_id] = test_data
-        save_json_file(TESTS_DATA_FILE, tests)
+        tests.put(test_id, test_data)
 
         return {
             "status": "success",
@@ -375,7 +506,7 @@ def handle_test_request(request):
         }
 
     elif action == 'update':
-        tests = load_json_file(TESTS_DATA_FILE)
+        tests = store['tests']
         test_id = request.get('id')
 
         if test_id in tests:
@@ -389,8 +520,7 @@ def handle_test_request(request):
                 "updated_at": datetime.now().isoformat()
             })
 
-            tests[test_id] = test_data
-            save_json_file(TESTS_DATA_FILE, tests)
+            tests.put(test_id, test_data)
 
             return {
                 "status": "success",
@@ -401,12 +531,11 @@ def handle_test_request(request):
             return {"status": "error", "message": "Test not found"}
 
     elif action == 'delete':
-        tests = load_json_file(TESTS_DATA_FILE)
+        tests = store['tests']
         test_id = request.get('id')
 
         if test_id in tests:
             deleted_test = tests.pop(test_id)
-            save_json_file(TESTS_DATA_FILE, tests)
 
             return {
                 "status": "success",
@@ -419,29 +548,24 @@ def handle_test_request(request):
     return {"status": "error", "message": "Invalid test action"}
 
 # ============== ALPHABET HANDLERS ==============
-def handle_alphabet_request(request):
+async def handle_alphabet_request(request, image_urls=False):
     action = request.get('action')
 
     if action == 'get_all':
-        alphabet = load_json_file(ALPHABET_DATA_FILE)
-        language = request.get('language', 'all')
+        if image_urls:
+            await prepare_assets('alphabet')
 
-        if language != 'all' and isinstance(alphabet, dict):
-            filtered_alphabet = {k: v for k, v in alphabet.items() if v.get('language') == language}
-            return {
-                "status": "success",
-                "letters": list(filtered_alphabet.values())
-            }
+        def add_image_urls(response):
+            if 'letters' in response:
+                response['letters'] = [dict(letter, imageUrl=asset_index.url_for(letter.get('imagePath', '')))
+                                       for letter in response['letters']]
+            return response
 
-        return {
-            "status": "success",
-            "letters": list(alphabet.values()) if isinstance(alphabet, dict) else alphabet
-        }
+        return get_all_response(request, 'alphabet', 'letters', ('language', 'category', 'groupId'),
+                                image_urls, add_image_urls if image_urls else None)
 
     elif action == 'create':
-        alphabet = load_json_file(ALPHABET_DATA_FILE)
-        if not isinstance(alphabet, dict):
-            alphabet = {}
+        alphabet = store['alphabet']
 
         letter_id = str(uuid.uuid4())
         letter_data = {
@@ -452,8 +576,7 @@ def handle_alphabet_request(request):
             "created_at": datetime.now().isoformat()
         }
 
-        alphabet[letter_id] = letter_data
-        save_json_file(ALPHABET_DATA_FILE, alphabet)
+        alphabet.put(letter_id, letter_data)
 
         return {
             "status": "success",
@@ -462,7 +585,7 @@ def handle_alphabet_request(request):
         }
 
     elif action == 'update':
-        alphabet = load_json_file(ALPHABET_DATA_FILE)
+        alphabet = store['alphabet']
         letter_id = request.get('id')
 
         if letter_id in alphabet:
@@ -474,8 +597,7 @@ def handle_alphabet_request(request):
                 "updated_at": datetime.now().isoformat()
             })
 
-            alphabet[letter_id] = letter_data
-            save_json_file(ALPHABET_DATA_FILE, alphabet)
+            alphabet.put(letter_id, letter_data)
 
             return {
                 "status": "success",
@@ -486,12 +608,11 @@ def handle_alphabet_request(request):
             return {"status": "error", "message": "Letter not found"}
 
     elif action == 'delete':
-        alphabet = load_json_file(ALPHABET_DATA_FILE)
+        alphabet = store['alphabet']
         letter_id = request.get('id')
 
         if letter_id in alphabet:
             deleted_letter = alphabet.pop(letter_id)
-            save_json_file(ALPHABET_DATA_FILE, alphabet)
 
             return {
                 "status": "success",
@@ -504,50 +625,63 @@ def handle_alphabet_request(request):
     return {"status": "error", "message": "Invalid alphabet action"}
 
 # ============== NOTE HANDLERS ==============
-def handle_note_request(request):
+async def upload_image(request, uploads=None):
+    # Картинка проверяется и уменьшается в пуле потоков; в запись (imagePath/imagePaths) идёт путь "path".
+    # Картинка целиком в "image" или частями в "chunk" (см. UploadBuffer)
+    try:
+        if 'chunk' in request and uploads is not None:
+            upload_id = uploads.append(request.get('uploadId'), request['chunk'])
+            if not request.get('final'):
+                return {"status": "success", "uploadId": upload_id, "received": len(uploads.data)}
+            image = await run_in_image_pool(ingest_image, uploads.take())
+        else:
+            image = await ingest_upload(request.get('image'))
+    except ImageRejected as e:
+        return {"status": "error", "message": str(e)}
+    return {
+        "status": "success",
+        "path": image['display'],
+        "thumbnailPath": image['thumbnail'],
+        "hash": image['hash'],
+        "deduplicated": image['deduplicated']
+    }
+
+async def handle_note_request(request, image_urls=False, uploads=None):
     action = request.get('action')
 
     if action == 'get_all':
-        notes = load_json_file(NOTES_DATA_FILE)
-        language = request.get('language', 'all')
-        if language != 'all' and isinstance(notes, dict):
-            filtered_notes = {k: v for k, v in notes.items() if v.get('language') == language}
-            return {
-                "status": "success",
-                "notes": list(filtered_notes.values())
-            }
-        return {
-            "status": "success",
-            "notes": list(notes.values()) if isinstance(notes, dict) else notes
-        }
+        return get_all_response(request, 'notes', 'notes', ('language', 'category', 'groupId'))
 
     elif action == 'get':
-        notes = load_json_file(NOTES_DATA_FILE)
+        notes = store['notes']
         note_id = request.get('id')
         if note_id in notes:
             note = notes[note_id]
             # Обработка markup [img:N]
             content = note.get('content', '')
             image_paths = note.get('imagePaths', [])
-            images_base64 = []
-            for path in image_paths:
-                try:
-                    with open(path, 'rb') as img_file:
-                        images_base64.append(base64.b64encode(img_file.read()).decode('utf-8'))
-                except Exception:
-                    images_base64.append('')
+            if request.get('variant') == 'thumbnail':
+                # Миниатюры для списков; у картинок, не прошедших приём, миниатюры нет - отдаём исходную
+                thumbnail_paths = note.get('thumbnailPaths') or []
+                image_paths = [thumbnail_paths[i] if i < len(thumbnail_paths) and thumbnail_paths[i] else path
+                               for i, path in enumerate(image_paths)]
+            if image_urls:
+                await asset_index.prepare(image_paths)
+                return {
+                    "status": "success",
+                    "note": note,
+                    "imageUrls": [asset_index.url_for(path) for path in image_paths]
+                }
             return {
                 "status": "success",
                 "note": note,
-                "images": images_base64
+                "images": [image_cache.get_base64(path) for path in image_paths]
             }
         else:
             return {"status": "error", "message": "Note not found"}
 
     elif action == 'create':
-        notes = load_json_file(NOTES_DATA_FILE)
-        if not isinstance(notes, dict):
-            notes = {}
+        notes = store['notes']
         # Автоинкремент id
         existing_ids = [int(k) for k in notes.keys() if k.isdigit()]
         new_id = str(max(existing_ids) + 1) if existing_ids else '1'
@@ -568,8 +702,9 @@ def handle_note_request(request):
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat()
         }
-        notes[new_id] = note_data
-        save_json_file(NOTES_DATA_FILE, notes)
+        note_data["thumbnailPaths"] = [thumbnail_for(path) for path in note_data["imagePaths"] or []]
+        notes.put(new_id, note_data)
+        schedule_note_translation(new_id)
         return {
             "status": "success",
             "message": "Note created successfully",
@@ -577,10 +712,11 @@ def handle_note_request(request):
         }
 
     elif action == 'update':
-        notes = load_json_file(NOTES_DATA_FILE)
+        notes = store['notes']
         note_id = request.get('id')
         if note_id in notes:
             note_data = notes[note_id]
+            source = {field: note_data.get(field) for field in ('language', *NOTE_TRANSLATED_FIELDS)}
             note_data.update({
                 "title": request.get('title', note_data.get('title')),
                 "content": request.get('content', note_data.get('content')),
@@ -588,8 +724,14 @@ def handle_note_request(request):
                 "language": request.get('language', note_data.get('language')),
                 "updated_at": datetime.now().isoformat()
             })
-            notes[note_id] = note_data
-            save_json_file(NOTES_DATA_FILE, notes)
+            note_data["thumbnailPaths"] = [thumbnail_for(path) for path in note_data.get("imagePaths") or []]
+            # Изменился переводимый текст - старые переводы больше не актуальны
+            translation_changed = any(note_data.get(field) != value for field, value in source.items())
+            if translation_changed:
+                note_data.pop('translations', None)
+            notes.put(note_id, note_data)
+            if translation_changed:
+                schedule_note_translation(note_id)
             return {
                 "status": "success",
                 "message": "Note updated successfully",
@@ -599,11 +741,13 @@ def handle_note_request(request):
             return {"status": "error", "message": "Note not found"}
 
     elif action == 'delete':
-        notes = load_json_file(NOTES_DATA_FILE)
+        notes = store['notes']
         note_id = request.get('id')
         if note_id in notes:
             deleted_note = notes.pop(note_id)
-            save_json_file(NOTES_DATA_FILE, notes)
+            task = note_translation_tasks.pop(note_id, None)
+            if task is not None:
+                task.cancel()
             return {
                 "status": "success",
                 "message": "Note deleted successfully",
@@ -613,131 +757,259 @@ def handle_note_request(request):
             return {"status": "error", "message": "Note not found"}
 
     elif action == 'upload_image':
-        # Для drag-n-drop PNG загрузки
-        image_data = request.get('image')  # base64
-        filename = request.get('filename', f"note_{uuid.uuid4()}.png")
-        save_dir = os.path.join('data', 'notes')
-        os.makedirs(save_dir, exist_ok=True)
-        file_path = os.path.join(save_dir, filename)
-        try:
-            with open(file_path, 'wb') as f:
-                f.write(base64.b64decode(image_data))
-            return {"status": "success", "path": file_path}
-        except Exception as e:
-            return {"status": "error", "message": str(e)}
+        # Для drag-n-drop загрузки картинок
+        return await upload_image(request, uploads)
 
     return {"status": "error", "message": "Invalid note action"}
 
+def schedule_note_translation(note_id):
+    task = note_translation_tasks.pop(note_id, None)
+    if task is not None:
+        task.cancel()
+    note_translation_tasks[note_id] = asyncio.get_running_loop().create_task(precompute_note_translations(note_id))
+
+async def precompute_note_translations(note_id):
+    # Переводы заголовка и текста сохраняются в конспекте (поле translations), get/get_all отдают их готовыми
+    notes = store['notes']
+    try:
+        note = notes.get(note_id)
+        if note is None:
+            return
+        source = {field: note.get(field) for field in ('language', *NOTE_TRANSLATED_FIELDS)}
+        translations = await translate_note(translator, note)
+        note = notes.get(note_id)
+        # Конспект удалили или изменили, пока шёл перевод
+        if note is None or any(note.get(field) != value for field, value in source.items()):
+            return
+        notes.put(note_id, dict(note, translations=translations))
+    except Exception as e:
+        log.warning("Error translating note", extra={"fields": {"note": note_id, "error": str(e)}})
+    finally:
+        if note_translation_tasks.get(note_id) is asyncio.current_task():
+            del note_translation_tasks[note_id]
+
 # ============== MAIN HANDLER ==============
+FRAME_ACTIONS = {'image', 'stream', 'recognize_batch'}
+CATALOG_ACTIONS = {'get_all', 'create', 'update', 'delete'}
+# Типы запросов и их действия, под которыми ведутся метрики: неизвестный тип учитывается как 'invalid',
+# неизвестное действие - как 'unknown', чтобы клиент не мог плодить метки
+REQUEST_ACTIONS = {
+    'auth': {'login', 'register'},
+    'user': {'update_tests', 'update_profile', 'reset_tests'},
+    'gesture': CATALOG_ACTIONS | FRAME_ACTIONS | {'upload_image'},
+    'gestures': set(),
+    'test': CATALOG_ACTIONS,
+    'alphabet': CATALOG_ACTIONS,
+    'note': CATALOG_ACTIONS | {'get', 'upload_image'},
+    'note_translate': set(),
+    'stats': set(),
+    'metrics': set(),
+}
+
+def request_labels(request_type, action):
+    if not isinstance(request_type, str) or request_type not in REQUEST_ACTIONS:
+        return ('invalid', '')
+    if action is None:
+        return (request_type, '')
+    return (request_type, action if isinstance(action, str) and action in REQUEST_ACTIONS[request_type] else 'unknown')
+
+def observe_request(labels, started):
+    requests_total.inc(*labels)
+    request_seconds.observe(time.perf_counter() - started, *labels)
+
+async def timed(labels, started, handle):
+    # Для потокового режима задержка считается до готового ответа, а не до постановки кадра в очередь
+    try:
+        return await handle()
+    finally:
+        observe_request(labels, started)
+
 async def handle_connection(websocket):
-    print(f"Client connected from {websocket.remote_address}")
-    users = load_json_file(USER_DATA_FILE)
+    client = websocket.remote_address
+    log.info("Client connected", extra={"fields": {"client": client}})
+    # Общий на процесс реестр пользователей: ничего не загружается и не копируется на соединение
+    users = user_registry
+    # Собственная сессия трекинга MediaPipe для кадров этого клиента
+    session = recognition_pool.open_session()
+    # Картинка, загружаемая частями
+    uploads = UploadBuffer()
+
+    async def send(response, sampled=True, deflate=False):
+        # Ответ сериализуется один раз (ответы каталога - один раз на версию коллекции):
+        # эти же байты уходят клиенту и (в сокращённом виде) в журнал
+        data = response.data if isinstance(response, Payload) else dumps(response)
+        if sampled and log.isEnabledFor(logging.DEBUG):
+            log.debug("Sending response", extra={"fields": {"client": client, "size": len(data), "body": preview(data)}})
+        if deflate and isinstance(response, Payload) and len(data) >= RESPONSE_DEFLATE_MIN:
+            # Бинарный кадр с JSON в формате zlib
+            await websocket.send(response.deflated)
+        else:
+            await websocket.send(data, text=True)
+
+    stream = FrameStream(lambda response: send(response, frame_log_sampler()))
+    active_connections.inc()
 
     try:
         async for message in websocket:
+            started = time.perf_counter()
+            labels = None
             try:
-                print(f"Received raw message: {message}")  # Выводим тело запроса
-                request = json.loads(message)
+                if isinstance(message, bytes):
+                    labels = ('frame', 'invalid')
+                    sampled = frame_log_sampler()
+                    try:
+                        header, payload = parse_frame(message)
+                    except FrameProtocolError as e:
+                        log.warning("Invalid frame", extra={"fields": {"client": client, "error": str(e)}})
+                        await send({"status": "error", "message": str(e)})
+                        continue
+                    if sampled:
+                        log.debug("Received frame", extra={"fields": {
+                            "client": client, "requestId": header.request_id, "codec": header.codec,
+                            "flags": header.flags, "size": len(payload), "sampled": frame_log_sampler.every}})
+                    if header.flags & FLAG_BATCH:
+                        labels = ('frame', 'batch')
+                        try:
+                            frames = split_batch(header, payload)
+                        except FrameProtocolError as e:
+                            await send({"status": "error", "message": str(e)})
+                            continue
+                        response = await recognize_gesture_batch(frames, header.codec, header.width,
+                                                                 header.height, header.language)
+                        response["requestId"] = header.request_id
+                        await send(response, sampled)
+                        continue
+                    if header.flags & FLAG_STREAM:
+                        stream.push(functools.partial(timed, ('frame', 'stream'), started,
+                                                      functools.partial(handle_gesture_frame, header, payload, session)))
+                        labels = None
+                        continue
+                    labels = ('frame', 'single')
+                    response = await handle_gesture_frame(header, payload, session)
+                    await send(response, sampled)
+                    continue
+
+                labels = ('invalid', '')
+                request = loads(message)
                 request_type = request.get('type')
-
-                print(f"Received request type: {request_type}")
+                action = request.get('action')
+                labels = request_labels(request_type, action)
+                # Клиент, передающий "images": "url", получает ссылки на сервер картинок вместо base64
+                image_urls = request.get('images') == 'url'
+                deflate = request.get('encoding') == 'deflate'
+
+                # Кадры камеры журналируются выборочно, остальные запросы - все (на уровне DEBUG)
+                sampled = not (request_type == 'gesture' and request.get('action') in FRAME_ACTIONS) or frame_log_sampler()
+                if sampled and log.isEnabledFor(logging.DEBUG):
+                    log.debug("Received request", extra={"fields": {
+                        "client": client, "size": len(message), "request": summarize_request(request)}})
 
                 if request_type == 'auth':
-                    response = handle_auth_request(request, users)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    await send(await handle_auth_request(request, users))
 
                 elif request_type == 'user':
-                    response = handle_user_request(request, users)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    await send(await handle_user_request(request, users))
+
+                elif request_type == 'gesture' and request.get('action') == 'stream':
+                    # Потоковый режим: ответ придёт из FrameStream, устаревшие кадры отбрасываются
+                    stream.push(functools.partial(timed, labels, started,
+                                                  functools.partial(handle_gesture_request, request, session)))
+                    labels = None
 
                 elif request_type == 'gesture':
-                    response = handle_gesture_request(request)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    await send(await handle_gesture_request(request, session, uploads), sampled, deflate)
 
                 elif request_type == 'gestures':
-                    gestures = load_json_file(GESTURES_DATA_FILE)
-                    gesture_list = []
-                    for gesture in (gestures.values() if isinstance(gestures, dict) else gestures):
-                        gesture_copy = dict(gesture)
-                        image_path = gesture_copy.get('imagePath', '')
-                        try:
-                            with open(image_path, 'rb') as img_file:
-                                gesture_copy['imageBase64'] = base64.b64encode(img_file.read()).decode('utf-8')
-                        except Exception as e:
-                            gesture_copy['imageBase64'] = ''
-                        gesture_list.append(gesture_copy)
-                    response = {
-                        "status": "success",
-                        "gestures": gesture_list
-                    }
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)[:500]} ...")
-                    await websocket.send(json.dumps(response))
+                    await send(await get_gestures_payload(image_urls), deflate=deflate)
 
                 elif request_type == 'test':
-                    response = handle_test_request(request)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    await send(handle_test_request(request), deflate=deflate)
 
                 elif request_type == 'alphabet':
-                    response = handle_alphabet_request(request)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    await send(await handle_alphabet_request(request, image_urls), deflate=deflate)
 
                 elif request_type == 'note':
-                    response = handle_note_request(request)
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)[:500]} ...")
-                    await websocket.send(json.dumps(response))
+                    await send(await handle_note_request(request, image_urls, uploads), deflate=deflate)
 
                 elif request_type == 'note_translate':
                     text = request.get('text', '')
                     src_lang = request.get('src_lang', 'uk')
                     dest_lang = request.get('dest_lang', 'en')
                     try:
-                        translated = translate_note_text(text, src_lang, dest_lang)
+                        translated = await translator.translate(text, src_lang, dest_lang)
                         response = {"status": "success", "translated": translated}
                     except Exception as e:
+                        log.warning("Translation failed", extra={"fields": {"error": str(e)}})
                         response = {"status": "error", "message": str(e)}
-                    await websocket.send(json.dumps(response))
+                    await send(response)
 
                 elif request_type == 'stats':
-                    users = load_json_file(USER_DATA_FILE)
-                    # Подсчёт уникальных пройденных конспектов всеми пользователями
-                    completed_notes = set()
-                    for u in users.values():
-                        for note_id in u.get('completedNotes', []):
-                            completed_notes.add(note_id)
-                    response = {
-                        "status": "success",
-                        "users_count": len(users),
-                        "completed_notes_count": len(completed_notes)
-                    }
-                    print(f"Sending response: {json.dumps(response, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(response))
+                    # Счётчики уже посчитаны, обхода пользователей нет
+                    await send(user_aggregates.stats())
+
+                elif request_type == 'metrics':
+                    # Те же метрики, что на HTTP-эндпоинте: текст Prometheus и сводка средних задержек.
+                    # HTTP-эндпоинт слушает только localhost, здесь метрики отдаются лишь администратору
+                    if not is_admin(request, users):
+                        await send({"status": "error", "message": "Admin access required"})
+                    else:
+                        await send({
+                            "status": "success",
+                            "metrics": registry.snapshot(),
+                            "prometheus": registry.render()
+                        })
 
                 else:
-                    print(f"Invalid request type: {request_type}")
-                    error_resp = {"status": "error", "message": "Invalid request type"}
-                    print(f"Sending response: {json.dumps(error_resp, ensure_ascii=False)}")
-                    await websocket.send(json.dumps(error_resp))
+                    log.warning("Invalid request type", extra={"fields": {"client": client, "type": request_type}})
+                    await send({"status": "error", "message": "Invalid request type"})
 
             except json.JSONDecodeError as e:
-                print(f"JSON decode error: {e}")
-                error_resp = {"status": "error", "message": "Invalid JSON"}
-                print(f"Sending response: {json.dumps(error_resp, ensure_ascii=False)}")
-                await websocket.send(json.dumps(error_resp))
-            except Exception as e:
-                print(f"Error processing message: {e}")
-                error_resp = {"status": "error", "message": "Error processing request"}
-                print(f"Sending response: {json.dumps(error_resp, ensure_ascii=False)}")
-                await websocket.send(json.dumps(error_resp))
+                log.warning("JSON decode error", extra={"fields": {"client": client, "error": str(e)}})
+                await send({"status": "error", "message": "Invalid JSON"})
+            except Exception:
+                log.exception("Error processing message", extra={"fields": {"client": client}})
+                await send({"status": "error", "message": "Error processing request"})
+            finally:
+                if labels is not None:
+                    observe_request(labels, started)
 
     except websockets.exceptions.ConnectionClosed:
-        print(f"Client {websocket.remote_address} disconnected")
-    except Exception as e:
-        print(f"Connection error: {e}")
+        pass
+    except Exception:
+        log.exception("Connection error", extra={"fields": {"client": client}})
+    finally:
+        active_connections.dec()
+        log.info("Client disconnected", extra={"fields": {"client": client}})
+        stream.close()
+        recognition_pool.close_session(session)
+
+def seed_default_users(users):
+    # Пользователи по умолчанию создаются через активное хранилище (json или sqlite), а не файлом users.json
+    if len(users):
+        return
+    default_users = {
+        "user@example.com": {
+            "password": hash_password("user123"),
+            "name": "User",
+            "photo": "",
+            "role": "user",
+            "completedTests": [],
+            "completedNotes": [],
+            "completedGestures": []
+        },
+        "admin@example.com": {
+            "password": hash_password("admin123"),
+            "name": "Admin",
+            "photo": "",
+            "role": "admin",
+            "completedTests": [],
+            "completedNotes": [],
+            "completedGestures": []
+        }
+    }
+    for email, user in default_users.items():
+        users.put(email, user)
+    log.info("Created default users", extra={"fields": {"count": len(default_users)}})
 
 async def main():
     # Создаем каталоги для хранения данных, если их нет
@@ -746,63 +1018,86 @@ async def main():
     os.makedirs('data/alphabet/en', exist_ok=True)
     os.makedirs('data/tests', exist_ok=True)
 
-    # Проверяем наличие файлов данных, создаем если их нет
-    if not os.path.exists(USER_DATA_FILE):
-        default_users = {
-            "user@example.com": {
-                "password": "user123",
-                "name": "User",
-                "photo": "",
-                "role": "user",
-                "completedTests": [],
-                "completedNotes": [],
-                "completedGestures": []
-            },
-            "admin@example.com": {
-                "password": "admin123",
-                "name": "Admin",
-                "photo": "",
-                "role": "admin",
-                "completedTests": [],
-                "completedNotes": [],
-                "completedGestures": []
-            }
-        }
-        save_json_file(USER_DATA_FILE, default_users)
-        print(f"Created default users file: {USER_DATA_FILE}")
-
-    # Создаем файлы для жестов, тестов и алфавита, если их нет
-    if not os.path.exists(GESTURES_DATA_FILE):
-        default_gestures = {}
-        save_json_file(GESTURES_DATA_FILE, default_gestures)
-        print(f"Created gestures file: {GESTURES_DATA_FILE}")
-
-    if not os.path.exists(TESTS_DATA_FILE):
-        default_tests = {}
-        save_json_file(TESTS_DATA_FILE, default_tests)
-        print(f"Created tests file: {TESTS_DATA_FILE}")
-
-    if not os.path.exists(ALPHABET_DATA_FILE):
-        default_alphabet = {}
-        save_json_file(ALPHABET_DATA_FILE, default_alphabet)
-        print(f"Created alphabet file: {ALPHABET_DATA_FILE}")
-
-    if not os.path.exists(NOTES_DATA_FILE):
-        default_notes = {}
-        save_json_file(NOTES_DATA_FILE, default_notes)
-        print(f"Created notes file: {NOTES_DATA_FILE}")
+    # Создаем файлы для жестов, тестов и алфавита, если их нет; в sqlite коллекции хранятся в базе
+    if store.backend == 'json':
+        if not os.path.exists(GESTURES_DATA_FILE):
+            default_gestures = {}
+            save_json_file(GESTURES_DATA_FILE, default_gestures)
+            log.info("Created gestures file", extra={"fields": {"path": GESTURES_DATA_FILE}})
+
+        if not os.path.exists(TESTS_DATA_FILE):
+            default_tests = {}
+            save_json_file(TESTS_DATA_FILE, default_tests)
+            log.info("Created tests file", extra={"fields": {"path": TESTS_DATA_FILE}})
+
+        if not os.path.exists(ALPHABET_DATA_FILE):
+            default_alphabet = {}
+            save_json_file(ALPHABET_DATA_FILE, default_alphabet)
+            log.info("Created alphabet file", extra={"fields": {"path": ALPHABET_DATA_FILE}})
+
+        if not os.path.exists(NOTES_DATA_FILE):
+            default_notes = {}
+            save_json_file(NOTES_DATA_FILE, default_notes)
+            log.info("Created notes file", extra={"fields": {"path": NOTES_DATA_FILE}})
+
+    store.load()
+    translator.load()
+
+    seed_default_users(user_registry)
 
     # В структуре пользователя добавляем completedNotes если его нет
-    users = load_json_file(USER_DATA_FILE)
-    for user in users.values():
+    users = store['users']
+    for username, user in list(users.items()):
         if 'completedNotes' not in user:
-            user['completedNotes'] = []
-    save_json_file(USER_DATA_FILE, users)
+            users.set_field(username, 'completedNotes', [])
+    user_aggregates.rebuild(users)
 
-    print("Starting WebSocket server on ws://0.0.0.0:8765")
-    async with websockets.serve(handle_connection, "0.0.0.0", 8765):
-        print("Server started successfully!")
-        await asyncio.Future()  # Run forever
+    writer.start()
+    log.info("Loaded collections", extra={"fields": {name: len(c) for name, c in store.collections.items()}})
+
+    # Конспекты без готовых переводов (созданные до появления переводов или правленные вручную) переводим в фоне
+    for note_id, note in store['notes'].items():
+        if 'translations' not in note:
+            schedule_note_translation(note_id)
+
+    recognition_pool.start()
+    log.info("Recognition pool started", extra={"fields": {"workers": recognition_pool.workers}})
+
+    # SIGTERM (docker stop, systemd) завершает сервер так же штатно, как Ctrl+C
+    stop = asyncio.get_running_loop().create_future()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set_result, None)
+    except NotImplementedError:
+        pass
+
+    asset_runner = await start_asset_server()
+    log.info("Asset server started", extra={"fields": {"url": f"http://0.0.0.0:{ASSET_HTTP_PORT}"}})
+    metrics_runner = await start_metrics_server()
+    if metrics_runner is not None:
+        log.info("Metrics available",
+                 extra={"fields": {"url": f"http://{METRICS_HTTP_HOST}:{METRICS_HTTP_PORT}/metrics"}})
+
+    log.info("Starting WebSocket server", extra={"fields": {"url": f"ws://0.0.0.0:{WS_PORT}"}})
+    try:
+        async with websockets.serve(handle_connection, "0.0.0.0", WS_PORT, **websocket_serve_options()):
+            log.info("Server started successfully!")
+            await stop  # Run forever
+    finally:
+        # Всё, что ещё не сброшено на диск, записываем перед выходом
+        for task in list(note_translation_tasks.values()):
+            task.cancel()
+        translator.close()
+        await store.close()
+        await asset_runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        recognition_pool.shutdown()
+        auth.shutdown()
+        image_pipeline.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        shutdown_logging()
\ No newline at end of file
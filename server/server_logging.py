@@ -0,0 +1,128 @@
+# server/server_logging.py
+# Журнал сервера через стандартный logging.
+#
+# Записи кладутся в очередь (QueueHandler), а форматирование и вывод делает отдельный поток
+# (QueueListener) - event loop не ждёт stdout. Тела запросов в журнал не попадают целиком:
+# длинные строки (base64-кадры, картинки) заменяются длиной и хэшем, пароли скрываются.
+# Кадры камеры идут десятками в секунду, поэтому из них журналируется только каждый LOG_FRAME_SAMPLE-й.
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Уровень журнала: DEBUG показывает каждый запрос и ответ, INFO - подключения и действия пользователей
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'text' - строка для человека, 'json' - одна JSON-строка на запись
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# Максимальная длина строкового значения и превью ответа в журнале
+LOG_FIELD_MAX = int(os.environ.get('LOG_FIELD_MAX', 80))
+LOG_PREVIEW_MAX = int(os.environ.get('LOG_PREVIEW_MAX', 300))
+# Глубже скольких уровней вложенные словари и списки заменяются размером
+LOG_NESTING_MAX = int(os.environ.get('LOG_NESTING_MAX', 4))
+# Из кадров распознавания журналируется каждый N-й
+LOG_FRAME_SAMPLE = int(os.environ.get('LOG_FRAME_SAMPLE', 100))
+
+SECRET_FIELDS = {'password', 'token'}
+
+_listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    # Дополнительные поля записи передаются через extra={'fields': {...}}
+    def __init__(self, fmt=LOG_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if self.fmt == 'json':
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **fields,
+            }
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))} "
+                f"{record.levelname:<7} {record.name}: {record.getMessage()}")
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(level=LOG_LEVEL):
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    # websockets журналирует каждое рукопожатие и ошибку соединения - оставляем только предупреждения
+    logging.getLogger('websockets').setLevel(max(root.level, logging.WARNING))
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        # Дописывает всё, что осталось в очереди
+        _listener.stop()
+        _listener = None
+
+
+def summarize_value(value, limit=LOG_FIELD_MAX, depth=0):
+    # Вложенные словари и списки (например, data в create/update) сокращаются так же, как верхний уровень
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes sha256:{hashlib.sha256(value).hexdigest()[:12]}>"
+    if isinstance(value, str) and len(value) > limit:
+        digest = hashlib.sha256(value.encode('utf-8', 'replace')).hexdigest()[:12]
+        return f"<{len(value)} chars sha256:{digest}>"
+    if isinstance(value, dict):
+        if depth >= LOG_NESTING_MAX:
+            return f"<dict of {len(value)}>"
+        return {key: '***' if key in SECRET_FIELDS else summarize_value(item, limit, depth + 1)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 10 or depth >= LOG_NESTING_MAX:
+            return f"<list of {len(value)}>"
+        return [summarize_value(item, limit, depth + 1) for item in value]
+    return value
+
+
+def summarize_request(request):
+    # Запрос для журнала: пароли скрыты, длинные значения заменены длиной и хэшем
+    return summarize_value(request)
+
+
+def preview(text, limit=LOG_PREVIEW_MAX):
+    if isinstance(text, (bytes, bytearray)):
+        if len(text) <= limit:
+            return text.decode('utf-8', 'replace')
+        return f"{text[:limit].decode('utf-8', 'replace')}... ({len(text)} bytes)"
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
+
+
+class Sampler:
+    # Пропускает в журнал каждое N-е событие
+    def __init__(self, every=LOG_FRAME_SAMPLE):
+        self.every = max(1, every)
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
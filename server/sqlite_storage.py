@@ -0,0 +1,136 @@
+# server/sqlite_storage.py
+# SQLite-бэкенд для коллекций сервера (STORAGE_BACKEND=sqlite).
+#
+# Каждая коллекция - отдельная таблица: id, индексируемые поля и сам документ в JSON.
+# Перенос существующих JSON-файлов:
+#   python sqlite_storage.py [путь к базе]
+import json
+import sqlite3
+import sys
+
+from storage import (COLLECTION_FILES, INDEXED_FIELDS, JOURNALED_COLLECTIONS, SQLITE_DATABASE, JournaledCollection,
+                     JsonCollection)
+
+
+def connect(database):
+    conn = sqlite3.connect(database, isolation_level=None)
+    # WAL: читатели не блокируют писателя, запись - дописывание в журнал
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class SqliteCollection:
+    # Тот же интерфейс, что у JsonCollection/JournaledCollection, но данные живут в таблице
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.version = 0
+
+    def load(self):
+        columns = ''.join(f', "{field}" TEXT' for field in INDEXED_FIELDS)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}" (id TEXT PRIMARY KEY{columns}, doc TEXT NOT NULL)')
+        for field in INDEXED_FIELDS:
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.name}_{field}" ON "{self.name}" ("{field}")')
+
+    def refresh(self):
+        pass
+
+    def __contains__(self, key):
+        return self.conn.execute(f'SELECT 1 FROM "{self.name}" WHERE id = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM "{self.name}"').fetchone()[0]
+
+    def __getitem__(self, key):
+        doc = self.get(key)
+        if doc is None:
+            raise KeyError(key)
+        return doc
+
+    def get(self, key, default=None):
+        row = self.conn.execute(f'SELECT doc FROM "{self.name}" WHERE id = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def keys(self):
+        return [row[0] for row in self.conn.execute(f'SELECT id FROM "{self.name}" ORDER BY rowid')]
+
+    def values(self):
+        return [json.loads(row[0]) for row in self.conn.execute(f'SELECT doc FROM "{self.name}" ORDER BY rowid')]
+
+    def items(self):
+        return [(row[0], json.loads(row[1]))
+                for row in self.conn.execute(f'SELECT id, doc FROM "{self.name}" ORDER BY rowid')]
+
+    def find(self, **filters):
+        # Фильтрация по индексируемым полям выполняется индексом SQLite
+        conditions = ' AND '.join(
+            f'"{field}" = ?' if field in INDEXED_FIELDS else f"json_extract(doc, '$.\"{field}\"') = ?"
+            for field in filters
+        )
+        query = f'SELECT doc FROM "{self.name}"'
+        if conditions:
+            query += f' WHERE {conditions}'
+        return [json.loads(row[0]) for row in self.conn.execute(query + ' ORDER BY rowid', tuple(filters.values()))]
+
+    def put(self, key, doc):
+        fields = ''.join(f', "{field}"' for field in INDEXED_FIELDS)
+        placeholders = ', ?' * len(INDEXED_FIELDS)
+        updates = ', '.join(f'"{field}" = excluded."{field}"' for field in (*INDEXED_FIELDS, 'doc'))
+        self.conn.execute(
+            f'INSERT INTO "{self.name}" (id{fields}, doc) VALUES (?{placeholders}, ?) '
+            f'ON CONFLICT(id) DO UPDATE SET {updates}',
+            (key, *(self._index_value(doc.get(field)) for field in INDEXED_FIELDS), json.dumps(doc, ensure_ascii=False)),
+        )
+        self.version += 1
+        return doc
+
+    def _index_value(self, value):
+        return value if value is None or isinstance(value, str) else json.dumps(value)
+
+    def pop(self, key):
+        doc = self[key]
+        self.conn.execute(f'DELETE FROM "{self.name}" WHERE id = ?', (key,))
+        self.version += 1
+        return doc
+
+    def rename(self, key, new_key):
+        self.conn.execute(f'UPDATE "{self.name}" SET id = ? WHERE id = ?', (new_key, key))
+        self.version += 1
+
+    def set_field(self, key, field, value):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            doc = self[key]
+            doc[field] = value
+            self.put(key, doc)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def set_list(self, key, field, values):
+        self.set_field(key, field, values)
+
+    def save(self):
+        pass
+
+
+def migrate(paths, database, journaled=()):
+    # Импорт JSON-коллекций (с учётом журнала) в базу SQLite; существующие записи перезаписываются
+    conn = connect(database)
+    for name, path in paths.items():
+        source = (JournaledCollection if name in journaled else JsonCollection)(path)
+        source.load()
+        target = SqliteCollection(conn, name)
+        target.load()
+        conn.execute('BEGIN')
+        for key, doc in source.items():
+            target.put(key, doc)
+        conn.execute('COMMIT')
+        print(f"Imported {len(source)} records from {path} into {database}:{name}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    migrate(COLLECTION_FILES, sys.argv[1] if len(sys.argv) > 1 else SQLITE_DATABASE, JOURNALED_COLLECTIONS)
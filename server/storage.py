@@ -0,0 +1,744 @@
+# server/storage.py
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+
+from metrics import storage_load_seconds, storage_save_seconds
+
+log = logging.getLogger('storage')
+
+# Где хранятся коллекции: 'json' (файлы *.json) или 'sqlite' (одна база SQLITE_DATABASE)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_DATABASE = os.environ.get('SQLITE_DATABASE', 'data.sqlite3')
+
+# Путь к файлам данных
+USER_DATA_FILE = 'users.json'
+GESTURES_DATA_FILE = 'gestures.json'
+TESTS_DATA_FILE = 'tests.json'
+ALPHABET_DATA_FILE = 'alphabet.json'
+NOTES_DATA_FILE = 'notes.json'
+COLLECTION_FILES = {
+    'gestures': GESTURES_DATA_FILE,
+    'tests': TESTS_DATA_FILE,
+    'alphabet': ALPHABET_DATA_FILE,
+    'notes': NOTES_DATA_FILE,
+    'users': USER_DATA_FILE,
+}
+# Прогресс пользователей пишется в журнал, а не переписыванием всего users.json
+JOURNALED_COLLECTIONS = {'users'}
+# Коллекции, которые клиент может синхронизировать по ревизиям: get_all с since/limit/cursor
+SYNCED_COLLECTIONS = ('gestures', 'tests', 'alphabet', 'notes')
+
+# Поля документов, по которым ведутся вторичные индексы (значение -> id документов)
+INDEXED_FIELDS = ('language', 'category', 'groupId')
+# Как часто (в секундах) проверять mtime файла коллекции на внешние правки
+MTIME_CHECK_INTERVAL = float(os.environ.get('STORAGE_MTIME_CHECK_INTERVAL', 1.0))
+# Отложенная запись: сброс на диск не позже чем через FLUSH_INTERVAL секунд после изменения
+# или сразу, когда накопилось FLUSH_MAX_PENDING изменений
+FLUSH_INTERVAL = float(os.environ.get('STORAGE_FLUSH_INTERVAL', 0.5))
+FLUSH_MAX_PENDING = int(os.environ.get('STORAGE_FLUSH_MAX_PENDING', 100))
+# Сколько записей журнала накапливается до сжатия его в файл-снимок
+JOURNAL_COMPACT_RECORDS = int(os.environ.get('STORAGE_JOURNAL_COMPACT_RECORDS', 1000))
+# Сколько последних удалений помнить для синхронизации; клиент, отставший сильнее, получает коллекцию целиком
+SYNC_TOMBSTONES_MAX = int(os.environ.get('STORAGE_SYNC_TOMBSTONES_MAX', 10000))
+
+
+def load_json_file(file_path):
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def dump_json(data):
+    return json.dumps(data, indent=4, ensure_ascii=False)
+
+
+# umask читается один раз при импорте: os.umask меняет его для всего процесса,
+# а запись идёт в нескольких потоках
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(file_path):
+    try:
+        return os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_file_atomic(file_path, text):
+    # Пишем во временный файл рядом и подменяем через os.replace:
+    # при сбое посреди записи на диске остаётся прежняя целая версия
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # mkstemp создаёт файл с правами 0600 - оставляем права прежнего файла (или обычные для нового)
+            os.fchmod(f.fileno(), _file_mode(file_path))
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def save_json_file(file_path, data):
+    write_file_atomic(file_path, dump_json(data))
+
+
+class FlushError(Exception):
+    # Часть файлов не записана; они остаются в очереди до следующего сброса
+    def __init__(self, paths):
+        super().__init__(f"Could not write {', '.join(paths)}")
+        self.paths = paths
+
+
+class WriteBehindWriter:
+    # Отложенная запись файлов: изменения помечают файл "грязным", а фоновая задача
+    # сбрасывает его на диск одним атомарным write. Серия изменений до сброса стоит одну запись
+    def __init__(self, interval=FLUSH_INTERVAL, max_pending=FLUSH_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._dirty = {}
+        self._pending = 0
+        self._task = None
+        self._has_dirty = None
+        self._full = None
+
+    def start(self):
+        if self._task is None:
+            self._has_dirty = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def dirty_files(self):
+        return len(self._dirty)
+
+    def mark_dirty(self, file_path, data, on_saved=None):
+        # data сериализуется в момент сброса, поэтому записывается последнее состояние
+        if self._task is None:
+            save_json_file(file_path, data)
+            if on_saved:
+                on_saved()
+            return
+        self._dirty[file_path] = (data, on_saved)
+        self._pending += 1
+        self._has_dirty.set()
+        if self._pending >= self.max_pending:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            await self._has_dirty.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except FlushError:
+                # Ошибки по каждому файлу уже в журнале
+                await asyncio.sleep(self.interval)
+            except Exception:
+                log.exception("Error flushing data files")
+                await asyncio.sleep(self.interval)
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, {}
+        self._pending = 0
+        if self._has_dirty is not None:
+            self._has_dirty.clear()
+            self._full.clear()
+
+        failed = []
+        entries = list(dirty.items())
+        for index, (file_path, (data, on_saved)) in enumerate(entries):
+            try:
+                # Снимок делаем в потоке event loop, пока данные никто не меняет; сама запись - в отдельном потоке
+                text = dump_json(data)
+                with storage_save_seconds.time(file_path):
+                    await asyncio.to_thread(write_file_atomic, file_path, text)
+            except Exception:
+                # Не потерять изменения: вернуть файл в очередь, если его не пометили заново,
+                # и записать остальные файлы
+                log.exception("Error writing data file", extra={"fields": {"path": file_path}})
+                self._dirty.setdefault(file_path, (data, on_saved))
+                failed.append(file_path)
+                continue
+            except BaseException:
+                # Отмена посреди сброса: этот и ещё не записанные файлы возвращаются в очередь
+                for path, entry in entries[index:]:
+                    self._dirty.setdefault(path, entry)
+                raise
+            # Если файл успели изменить снова, он остаётся "грязным" до следующего сброса
+            if on_saved and file_path not in self._dirty:
+                on_saved()
+
+        if failed:
+            if self._has_dirty is not None:
+                self._has_dirty.set()
+            raise FlushError(failed)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class JsonCollection:
+    # Коллекция документов {id: документ}, загруженная в память.
+    # Чтения обслуживаются из памяти, изменения сохраняются через WriteBehindWriter;
+    # если файл правили снаружи (изменился mtime), коллекция перечитывается
+    def __init__(self, path, writer=None, indexed=INDEXED_FIELDS):
+        self.path = path
+        self.writer = writer
+        self.indexed = tuple(indexed)
+        # field -> значение -> {id: None}; dict сохраняет порядок добавления документов
+        self._indexes = {}
+        # id -> значения индексируемых полей, под которыми документ сейчас лежит в индексах
+        self._indexed_values = {}
+        self._data = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._dirty = False
+        # Растёт при каждом изменении коллекции; по нему сбрасываются производные кэши
+        self.version = 0
+
+    def load(self):
+        data = load_json_file(self.path)
+        if isinstance(data, list):
+            data = {doc['id']: doc for doc in data if isinstance(doc, dict) and 'id' in doc}
+        elif not isinstance(data, dict):
+            data = {}
+        self._data = data
+        self._mtime = self._stat()
+        self._checked_at = time.monotonic()
+        self._rebuild_indexes()
+        self.version += 1
+
+    def _rebuild_indexes(self):
+        self._indexes = {field: {} for field in self.indexed}
+        self._indexed_values = {}
+        for key in self._data:
+            self._index(key)
+
+    @staticmethod
+    def _index_key(value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+    def _index(self, key):
+        # Переиндексация документа после изменения: трогаем только поля, значение которых сменилось
+        if not self.indexed:
+            return
+        doc = self._data.get(key)
+        old_values = self._indexed_values.pop(key, {})
+        new_values = {}
+        if isinstance(doc, dict):
+            new_values = {field: self._index_key(doc.get(field)) for field in self.indexed}
+        for field in self.indexed:
+            if field in old_values and old_values[field] == new_values.get(field):
+                continue
+            if field in old_values:
+                bucket = self._indexes[field].get(old_values[field])
+                if bucket is not None:
+                    bucket.pop(key, None)
+                    if not bucket:
+                        del self._indexes[field][old_values[field]]
+            if field in new_values:
+                self._indexes[field].setdefault(new_values[field], {})[key] = None
+        if new_values:
+            self._indexed_values[key] = new_values
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        now = time.monotonic()
+        # Пока есть несохранённые изменения, память новее файла
+        if self._dirty or now - self._checked_at < MTIME_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._stat() != self._mtime:
+            log.info("Reloading collection changed on disk", extra={"fields": {"path": self.path}})
+            self.load()
+
+    @property
+    def data(self):
+        self.refresh()
+        return self._data
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def items(self):
+        return self.data.items()
+
+    def find(self, **filters):
+        data = self.data
+        indexed = {field: value for field, value in filters.items() if field in self._indexes}
+        if not indexed:
+            return [doc for doc in data.values()
+                    if all(doc.get(field) == value for field, value in filters.items())]
+
+        # Берём самый короткий список id из индексов и проверяем остальные условия только на нём
+        buckets = [self._indexes[field].get(self._index_key(value), {}) for field, value in indexed.items()]
+        smallest = min(buckets, key=len)
+        rest = {field: value for field, value in filters.items() if field not in indexed}
+        return [data[key] for key in smallest
+                if all(key in bucket for bucket in buckets)
+                and all(data[key].get(field) == value for field, value in rest.items())]
+
+    def put(self, key, doc):
+        self.data[key] = doc
+        self._index(key)
+        self.version += 1
+        self.save()
+        return doc
+
+    def pop(self, key):
+        doc = self.data.pop(key)
+        self._index(key)
+        self.version += 1
+        self.save()
+        return doc
+
+    def save(self):
+        self._dirty = True
+        if self.writer is None:
+            with storage_save_seconds.time(self.path):
+                save_json_file(self.path, self._data)
+            self._saved()
+        else:
+            self.writer.mark_dirty(self.path, self._data, self._saved)
+
+    def _saved(self):
+        self._dirty = False
+        self._mtime = self._stat()
+
+
+class JournaledCollection(JsonCollection):
+    # Коллекция с журналом изменений: каждое изменение дописывается в конец файла
+    # <path>.journal одной короткой JSON-строкой, а файл-снимок <path> переписывается
+    # только при сжатии журнала. Стоимость записи зависит от размера изменения,
+    # а не от размера коллекции. При загрузке журнал применяется поверх снимка
+    def __init__(self, path, writer=None, compact_records=JOURNAL_COMPACT_RECORDS, indexed=()):
+        super().__init__(path, writer, indexed)
+        self.journal_path = path + '.journal'
+        self.compact_records = compact_records
+        self._journal = None
+        self._records = 0
+        self._compacting = None
+
+    def load(self):
+        super().load()
+        # .compacting - журнал, сжатие которого прервалось; операции идемпотентны
+        # (rename проверяет исходный документ), поэтому его можно применить повторно поверх уже нового снимка
+        compacting_path = self.journal_path + '.compacting'
+        self._records = 0
+        for journal_path in (compacting_path, self.journal_path):
+            self._records += self._replay(journal_path)
+        if os.path.exists(compacting_path):
+            # Доводим прерванное сжатие до конца, пока сервер ещё не принимает запросы
+            write_file_atomic(self.path, dump_json(self._data))
+            os.unlink(compacting_path)
+            if os.path.exists(self.journal_path):
+                os.unlink(self.journal_path)
+            self._records = 0
+
+    def _replay(self, journal_path):
+        if not os.path.exists(journal_path):
+            return 0
+        count = 0
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная последняя строка после сбоя
+                    log.warning("Skipping damaged journal record", extra={"fields": {"path": journal_path}})
+                    continue
+                self._apply(record)
+                count += 1
+        return count
+
+    def _apply(self, record):
+        self.version += 1
+        op = record['op']
+        key = record['id']
+        if op == 'put':
+            self._data[key] = record['doc']
+            self._index(key)
+            return
+        if op == 'del':
+            self._data.pop(key, None)
+            self._index(key)
+            return
+        doc = self._data.get(key)
+        if doc is None:
+            return
+        if op == 'rename':
+            # Снимок мог уже включать это переименование, а под старым id - лежать другой документ
+            if 'doc' in record and doc != record['doc']:
+                return
+            self._data[record['to']] = self._data.pop(key)
+            self._index(key)
+            self._index(record['to'])
+            return
+        elif op == 'set':
+            doc[record['field']] = record['value']
+        elif op == 'add':
+            items = doc.setdefault(record['field'], [])
+            items.extend(value for value in record['values'] if value not in items)
+        elif op == 'remove':
+            removed = record['values']
+            doc[record['field']] = [value for value in doc.get(record['field'], []) if value not in removed]
+        if record['field'] in self._indexes:
+            self._index(key)
+
+    def refresh(self):
+        # Внешние правки снимка не отслеживаются: состояние = снимок + журнал
+        pass
+
+    def _append(self, record):
+        self._apply(record)
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        with storage_save_seconds.time(self.journal_path):
+            self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._journal.flush()
+        self._records += 1
+        if self._records >= self.compact_records:
+            self.compact()
+
+    def put(self, key, doc):
+        self._append({"op": "put", "id": key, "doc": doc})
+        return doc
+
+    def pop(self, key):
+        doc = self._data[key]
+        self._append({"op": "del", "id": key})
+        return doc
+
+    def rename(self, key, new_key):
+        self._append({"op": "rename", "id": key, "to": new_key, "doc": self._data[key]})
+
+    def set_field(self, key, field, value):
+        self._append({"op": "set", "id": key, "field": field, "value": value})
+
+    def set_list(self, key, field, values):
+        # Для списков (completedTests и т.п.) в журнал пишется только разница
+        current = self._data[key].get(field)
+        if not isinstance(current, list) or not isinstance(values, list):
+            self.set_field(key, field, values)
+            return
+        added = [value for value in values if value not in current]
+        removed = [value for value in current if value not in values]
+        kept = [value for value in current if value in values]
+        if kept + added != values or len(set(map(json.dumps, values))) != len(values):
+            # Порядок или повторы не выражаются разницей - пишем список целиком
+            self.set_field(key, field, values)
+            return
+        if removed:
+            self._append({"op": "remove", "id": key, "field": field, "values": removed})
+        if added:
+            self._append({"op": "add", "id": key, "field": field, "values": added})
+
+    def compact(self):
+        # Текущий журнал откладывается в .compacting, новые записи идут в свежий журнал.
+        # Снимок пишется атомарно, после чего отложенный журнал удаляется
+        if self._compacting is not None:
+            return
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if not os.path.exists(self.journal_path):
+            return
+        compacting_path = self.journal_path + '.compacting'
+        if os.path.exists(compacting_path):
+            # Предыдущее сжатие не удалось: дописываем к нему текущий журнал
+            with open(self.journal_path, 'rb') as src, open(compacting_path, 'ab') as dst:
+                dst.write(src.read())
+            os.unlink(self.journal_path)
+        else:
+            os.replace(self.journal_path, compacting_path)
+        self._records = 0
+
+        text = dump_json(self._data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            self._write_snapshot(text)
+        else:
+            self._compacting = loop.create_task(asyncio.to_thread(self._write_snapshot, text))
+            self._compacting.add_done_callback(self._compacted)
+
+    def _write_snapshot(self, text):
+        with storage_save_seconds.time(self.path):
+            write_file_atomic(self.path, text)
+        os.unlink(self.journal_path + '.compacting')
+
+    def _compacted(self, task):
+        self._compacting = None
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error compacting journal",
+                      extra={"fields": {"path": self.journal_path, "error": str(task.exception())}})
+
+    async def close(self):
+        if self._compacting is not None:
+            await self._compacting
+        self.compact()
+        if self._compacting is not None:
+            await self._compacting
+
+
+class RevisionedCollection:
+    # Коллекция с ревизиями для синхронизации изменений (get_all с since/cursor).
+    # Каждое изменение документа получает следующий номер ревизии в поле "_rev",
+    # удаление оставляет "надгробие" {id: ревизия} в файле <path>.tombstones (там же счётчик ревизий).
+    # В памяти ведётся список (ревизия, id), отсортированный по ревизии: выборка изменений после since
+    # начинается с bisect и стоит O(изменений), а не O(коллекции).
+    # Документы без "_rev" (записанные до появления ревизий или добавленные в файл вручную)
+    # получают ревизию в памяти; в файл она попадёт при следующей записи коллекции.
+    # Чтения проходят в обёрнутую коллекцию без изменений
+    def __init__(self, collection, path, writer=None, max_tombstones=SYNC_TOMBSTONES_MAX):
+        self.collection = collection
+        self.tombstones_path = path + '.tombstones'
+        self.writer = writer
+        self.max_tombstones = max_tombstones
+        self.revision = 0
+        # Ревизии не старше horizon могли потерять надгробия - такому клиенту нужна полная выгрузка
+        self.horizon = 0
+        self.tombstones = {}
+        # (ревизия, id) документов и надгробий по возрастанию ревизий; id -> ревизия
+        self._log = []
+        self._revisions = {}
+        # Версия обёрнутой коллекции, по которой построен _log
+        self._revisions_version = None
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __contains__(self, key):
+        return key in self.collection
+
+    def __len__(self):
+        return len(self.collection)
+
+    def __getitem__(self, key):
+        return self.collection[key]
+
+    def load(self):
+        state = load_json_file(self.tombstones_path)
+        self.tombstones = state.get('deleted', {})
+        self.horizon = state.get('horizon', 0)
+        self.revision = max([self.horizon, state.get('revision', 0), *self.tombstones.values()])
+        self._revisions_version = None
+        self._sync_index()
+
+    def _sync_index(self):
+        # Список перестраивается, только если коллекция менялась не через put()/pop() (перечитана с диска, rename)
+        self.collection.refresh()
+        if self.collection.version == self._revisions_version:
+            return
+        revisions = dict(self.tombstones)
+        unstamped = []
+        for key, doc in self.collection.items():
+            if not isinstance(doc, dict):
+                continue
+            if isinstance(doc.get('_rev'), int):
+                revisions[key] = doc['_rev']
+                self.revision = max(self.revision, doc['_rev'])
+            else:
+                unstamped.append((key, doc))
+        for key, doc in unstamped:
+            self.revision += 1
+            revisions[key] = doc['_rev'] = self.revision
+        self._revisions = revisions
+        self._log = sorted((revision, key) for key, revision in revisions.items())
+        self._revisions_version = self.collection.version
+        if unstamped:
+            # Выданные ревизии не должны повториться после перезапуска
+            self._save_tombstones()
+
+    def _changed(self, change):
+        # Изменение через обёртку учтено в _log - перестраивать не нужно,
+        # если версия выросла ровно на это изменение (а не из-за перечитывания файла)
+        before = self.collection.version
+        result = change()
+        if self._revisions_version == before and self.collection.version == before + 1:
+            self._revisions_version = self.collection.version
+        return result
+
+    def _unlog(self, key):
+        revision = self._revisions.pop(key, None)
+        if revision is not None:
+            index = bisect.bisect_left(self._log, (revision, key))
+            if index < len(self._log) and self._log[index] == (revision, key):
+                del self._log[index]
+
+    def _log_change(self, key, revision):
+        self._unlog(key)
+        self._revisions[key] = revision
+        self._log.append((revision, key))
+
+    def put(self, key, doc):
+        self._sync_index()
+        self.revision += 1
+        doc['_rev'] = self.revision
+        result = self._changed(lambda: self.collection.put(key, doc))
+        self._log_change(key, doc['_rev'])
+        if self.tombstones.pop(key, None) is not None:
+            self._save_tombstones()
+        return result
+
+    def pop(self, key):
+        self._sync_index()
+        doc = self._changed(lambda: self.collection.pop(key))
+        self.revision += 1
+        self.tombstones[key] = self.revision
+        self._log_change(key, self.revision)
+        if len(self.tombstones) > self.max_tombstones:
+            # Самые старые надгробия забываются, горизонт сдвигается за них
+            for old_key, old_revision in sorted(self.tombstones.items(), key=lambda item: item[1])[
+                    :len(self.tombstones) - self.max_tombstones]:
+                del self.tombstones[old_key]
+                self._unlog(old_key)
+                self.horizon = max(self.horizon, old_revision)
+        self._save_tombstones()
+        return doc
+
+    def _save_tombstones(self):
+        state = {"horizon": self.horizon, "revision": self.revision, "deleted": self.tombstones}
+        if self.writer is None:
+            save_json_file(self.tombstones_path, state)
+        else:
+            self.writer.mark_dirty(self.tombstones_path, state)
+
+    def changes(self, since=0, limit=None, cursor=None, **filters):
+        # Изменения после ревизии since по возрастанию ревизий: (документы, удалённые id, следующий курсор, reset).
+        # Курсор - ревизия последнего отданного изменения; None, если больше ничего нет.
+        # Полная выгрузка (reset) может начинаться ниже горизонта, поэтому её курсор -
+        # строка "ревизия:горизонт на начало выгрузки"; продолжение не считается отставанием,
+        # пока горизонт не ушёл дальше. Неверный курсор - ValueError
+        self._sync_index()
+        snapshot = None
+        if cursor is not None:
+            position, _, snapshot_horizon = str(cursor).partition(':')
+            since = int(position)
+            if snapshot_horizon:
+                snapshot = int(snapshot_horizon)
+        reset = max(since, snapshot or 0) < self.horizon or since > self.revision
+        if reset:
+            since = 0
+            snapshot = self.horizon
+
+        docs = []
+        deleted = []
+        next_cursor = None
+        last = since
+        for revision, key in itertools.islice(self._log, bisect.bisect_right(self._log, (since, chr(0x10FFFF))), None):
+            if key in self.tombstones:
+                # Полной выгрузке удаления не нужны; фильтр к удалённому документу не применить - id отдаётся всегда
+                if since:
+                    event = (None, key)
+                else:
+                    continue
+            else:
+                doc = self.collection.get(key)
+                if doc is None or any(doc.get(field) != value for field, value in filters.items()):
+                    continue
+                if doc.get('_rev') != revision:
+                    doc = dict(doc, _rev=revision)
+                event = (doc, None)
+            if limit is not None and len(docs) + len(deleted) >= limit:
+                next_cursor = last if snapshot is None else f"{last}:{snapshot}"
+                break
+            if event[0] is not None:
+                docs.append(event[0])
+            else:
+                deleted.append(event[1])
+            last = revision
+        return docs, deleted, next_cursor, reset
+
+
+class DocumentStore:
+    # Все коллекции сервера; загружаются один раз при старте
+    def __init__(self, paths, writer=None, journaled=(), backend=STORAGE_BACKEND, revisioned=()):
+        self.writer = writer
+        self.backend = backend
+        self.conn = None
+        if backend == 'sqlite':
+            from sqlite_storage import SqliteCollection, connect
+            self.conn = connect(SQLITE_DATABASE)
+            self.collections = {name: SqliteCollection(self.conn, name) for name in paths}
+        elif backend == 'json':
+            self.collections = {
+                name: (JournaledCollection if name in journaled else JsonCollection)(path, writer)
+                for name, path in paths.items()
+            }
+        else:
+            raise ValueError(f"Unknown storage backend: {backend}")
+        # Коллекции, которые клиенты синхронизируют по ревизиям (get_all с since/cursor)
+        self.revisioned = {
+            name: RevisionedCollection(self.collections[name], paths[name], writer) for name in revisioned
+        }
+
+    def __getitem__(self, name):
+        if name in self.revisioned:
+            return self.revisioned[name]
+        return self.collections[name]
+
+    def load(self):
+        for name, collection in self.collections.items():
+            with storage_load_seconds.time(name):
+                collection.load()
+                if name in self.revisioned:
+                    self.revisioned[name].load()
+
+    async def close(self):
+        for collection in self.collections.values():
+            if isinstance(collection, JournaledCollection):
+                await collection.close()
+        if self.writer is not None:
+            await self.writer.close()
+        if self.conn is not None:
+            self.conn.close()
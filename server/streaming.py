@@ -0,0 +1,68 @@
+# server/streaming.py
+import asyncio
+import logging
+
+import websockets
+
+log = logging.getLogger('streaming')
+
+
+class FrameStream:
+    # Потоковое распознавание по принципу "побеждает последний кадр":
+    # у соединения хранится не больше одного ожидающего кадра, более старые отбрасываются,
+    # поэтому задержка ответа не растёт, даже если клиент шлёт кадры быстрее, чем сервер успевает
+    def __init__(self, send):
+        self._send = send
+        self._pending = None
+        self._ready = asyncio.Event()
+        self._task = None
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def push(self, recognize):
+        # recognize - функция без аргументов, возвращающая корутину с ответом для клиента
+        self.received += 1
+        if self._pending is not None:
+            self.dropped += 1
+        self._pending = recognize
+        self._ready.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def counters(self):
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                recognize, self._pending = self._pending, None
+
+                try:
+                    response = await recognize()
+                    self.processed += 1
+                    response["stream"] = self.counters()
+                    await self._send(response)
+                except websockets.exceptions.ConnectionClosed:
+                    raise
+                except Exception:
+                    # Ошибка одного кадра не останавливает поток: следующий кадр обрабатывается как обычно
+                    log.exception("Stream processing error")
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            # Задача завершилась - следующий push() запустит новую, а не оставит кадр без обработки
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._pending = None
@@ -0,0 +1,58 @@
+# server/test_auth.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import hashlib
+import unittest
+from unittest import mock
+
+import auth
+
+
+class ReadTokenTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(auth, '_secret', b'test-secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_valid_token(self):
+        claims = auth.read_token(auth.issue_token('user@example.com', 'stored'))
+        self.assertTrue(auth.token_matches(claims, 'user@example.com', 'stored'))
+
+    def test_tampered_token(self):
+        payload, signature = auth.issue_token('user@example.com', 'stored').split('.')
+        self.assertIsNone(auth.read_token(f"{payload}.{signature[:-1]}A"))
+        self.assertIsNone(auth.read_token(f"{payload}x.{signature}"))
+
+    def test_expired_token(self):
+        self.assertIsNone(auth.read_token(auth.issue_token('user@example.com', 'stored', ttl=-1)))
+
+    def test_malformed_tokens(self):
+        payload, signature = auth.issue_token('user@example.com', 'stored').split('.')
+        for token in (None, 42, '', '.', 'abc', 'a.b.c', 'ключ.подпис', f"{payload}.{signature}é",
+                      f"{payload}é.{signature}", '\ud800.x', 'a\x00.b', f"{payload}.١٢"):
+            with self.subTest(token=token):
+                self.assertIsNone(auth.read_token(token))
+
+
+class VerifyPasswordTestCase(unittest.TestCase):
+    def test_legacy_sha256_hash_is_not_a_password(self):
+        stored = hashlib.sha256(b'secret').hexdigest()
+        self.assertEqual(auth.verify_password(stored, 'secret'), (True, True))
+        self.assertEqual(auth.verify_password(stored, stored)[0], False)
+        self.assertEqual(auth.verify_password('plain-text', 'plain-text'), (True, True))
+
+    def test_pbkdf2_is_rehashed_only_when_outdated(self):
+        with mock.patch.object(auth, 'hashlib', mock.Mock(wraps=hashlib, spec=['pbkdf2_hmac', 'sha256'])), \
+                mock.patch.object(auth, 'PBKDF2_ITERATIONS', 1000):
+            stored = auth.hash_password('secret')
+            self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+            self.assertEqual(auth.verify_password(stored, 'secret'), (True, False))
+            self.assertEqual(auth.verify_password(stored, 'wrong'), (False, False))
+            with mock.patch.object(auth, 'PBKDF2_ITERATIONS', 2000):
+                self.assertEqual(auth.verify_password(stored, 'secret'), (True, True))
+        # С доступным scrypt хэш pbkdf2 переводится на scrypt
+        self.assertEqual(auth.verify_password(stored, 'secret'), (True, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# server/test_recognition.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from recognition import RecognitionPool
+
+
+def session_result(session_id):
+    return {"session": session_id}
+
+
+class RecognitionPoolTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = RecognitionPool(workers=1)
+        self.pool.start()
+        self.addCleanup(self.pool.shutdown)
+
+    async def test_dead_worker_is_replaced(self):
+        session = self.pool.open_session()
+        pid = await self.pool._submit(0, os.getpid)
+        self.assertEqual(await self.pool._run(session, session_result), {"session": session.id})
+        self.assertEqual(session.worker, 0)
+
+        with self.assertRaises(BrokenProcessPool):
+            await self.pool._submit(0, os._exit, 1)
+
+        self.assertNotEqual(await self.pool._submit(0, os.getpid), pid)
+        # Сессия заново закрепляется за воркером, счётчик не удваивается
+        self.assertEqual(await self.pool._run(session, session_result), {"session": session.id})
+        self.assertEqual(self.pool._sessions_per_worker, [1])
+        self.pool.close_session(session)
+        self.assertEqual(self.pool._sessions_per_worker, [0])
+        self.assertEqual(self.pool.pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+# server/test_server.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import websockets
+from PIL import Image
+
+import auth
+import image_pipeline
+import server
+import storage
+from aggregates import AggregatedCollection, UserAggregates
+from frame_protocol import CODEC_BGR, RAW_FRAME_MAX_PIXELS, pack_frame
+from response_cache import ResponseCache
+from storage import DocumentStore, JsonCollection
+from user_registry import UserRegistry
+
+
+class FakeRecognitionPool:
+    # Пул без MediaPipe: проверяется путь сообщения до распознавания, а не само распознавание
+    pending = 0
+
+    def open_session(self):
+        return None
+
+    def close_session(self, session):
+        pass
+
+    async def recognize_frame(self, header, payload, session):
+        return {"gesture": "", "size": len(payload)}
+
+    async def recognize_batch(self, frames, codec, width, height, language):
+        return [{"gesture": "", "size": len(frame)} for frame in frames]
+
+
+class WebSocketServerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(server, 'recognition_pool', FakeRecognitionPool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = await websockets.serve(server.handle_connection, '127.0.0.1', 0,
+                                             **server.websocket_serve_options())
+        self.url = f"ws://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def batch_message(self, size):
+        # recognize_batch из BATCH_MAX_FRAMES кадров, всего size байт
+        empty = json.dumps({"type": "gesture", "action": "recognize_batch",
+                            "frames": [""] * server.BATCH_MAX_FRAMES})
+        frame_size, extra = divmod(size - len(empty), server.BATCH_MAX_FRAMES)
+        frames = ["A" * (frame_size + (i < extra)) for i in range(server.BATCH_MAX_FRAMES)]
+        message = json.dumps({"type": "gesture", "action": "recognize_batch", "frames": frames})
+        self.assertEqual(len(message), size)
+        return message
+
+    async def test_full_batch_fits_message_limit(self):
+        self.assertGreaterEqual(server.WS_MAX_MESSAGE_BYTES,
+                                server.BATCH_MAX_FRAMES * server.BATCH_FRAME_BYTES)
+        async with websockets.connect(self.url, max_size=None) as websocket:
+            await websocket.send(self.batch_message(server.WS_MAX_MESSAGE_BYTES - 1024))
+            response = json.loads(await asyncio.wait_for(websocket.recv(), 60))
+        self.assertEqual(response["status"], "success")
+        self.assertEqual(len(response["results"]), server.BATCH_MAX_FRAMES)
+
+    async def test_message_over_limit_closes_connection(self):
+        async with websockets.connect(self.url, max_size=None) as websocket:
+            await websocket.send(self.batch_message(server.WS_MAX_MESSAGE_BYTES + 1024))
+            with self.assertRaises(websockets.exceptions.ConnectionClosed) as closed:
+                await asyncio.wait_for(websocket.recv(), 60)
+        self.assertEqual(closed.exception.rcvd.code, 1009)
+
+    async def upload_chunks(self, websocket, data, chunk_size, type='note'):
+        response = None
+        for offset in range(0, len(data), chunk_size):
+            request = {"type": type, "action": "upload_image",
+                       "chunk": base64.b64encode(data[offset:offset + chunk_size]).decode('ascii'),
+                       "final": offset + chunk_size >= len(data)}
+            if response is not None:
+                request["uploadId"] = response["uploadId"]
+            await websocket.send(json.dumps(request))
+            response = json.loads(await asyncio.wait_for(websocket.recv(), 60))
+            if response["status"] != "success":
+                break
+        return response
+
+    async def test_image_larger_than_message_limit_uploads_in_chunks(self):
+        image = io.BytesIO()
+        Image.effect_noise((1400, 1400), 64).convert('RGB').save(image, 'PNG')
+        data = image.getvalue()
+        self.assertGreater(len(data) * 4 // 3, server.WS_MAX_MESSAGE_BYTES)
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(image_pipeline, 'IMAGE_DIR', directory):
+            async with websockets.connect(self.url) as websocket:
+                response = await self.upload_chunks(websocket, data, 1024 * 1024)
+            self.assertEqual(response["status"], "success")
+            self.assertTrue(os.path.exists(response["path"]))
+            self.assertTrue(response["path"].startswith(directory))
+
+    async def test_chunked_upload_over_limit_is_rejected(self):
+        with mock.patch.object(image_pipeline, 'IMAGE_MAX_UPLOAD_BYTES', 3000):
+            async with websockets.connect(self.url) as websocket:
+                response = await self.upload_chunks(websocket, bytes(4000), 1000, type='gesture')
+                self.assertEqual(response["status"], "error")
+                self.assertIn("larger than", response["message"])
+                # Отменённую загрузку продолжить нельзя
+                await websocket.send(json.dumps({"type": "gesture", "action": "upload_image",
+                                                 "uploadId": "x", "chunk": "AAAA"}))
+                response = json.loads(await asyncio.wait_for(websocket.recv(), 60))
+        self.assertEqual(response, {"status": "error", "message": "Unknown upload"})
+
+    async def test_image_urls_do_not_depend_on_host(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'gestures.json')
+            storage.save_json_file(path, {'1': {'id': '1', 'imagePath': 'data/gestures/hello.png'}})
+            store = DocumentStore({'gestures': path}, backend='json', revisioned=('gestures',))
+            store.load()
+            cache = ResponseCache()
+            with mock.patch.object(server, 'store', store), mock.patch.object(server, 'response_cache', cache):
+                responses = []
+                for host in ('127.0.0.1', 'localhost'):
+                    async with websockets.connect(self.url.replace('127.0.0.1', host)) as websocket:
+                        await websocket.send(json.dumps({"type": "gestures", "images": "url"}))
+                        responses.append(await asyncio.wait_for(websocket.recv(), 60))
+        # Один сериализованный ответ на всех клиентов, адрес относительно сервера картинок
+        self.assertEqual(len(set(responses)), 1)
+        self.assertEqual(len(cache._entries), 1)
+        self.assertRegex(json.loads(responses[0])["gestures"][0]["imageUrl"],
+                         r'^/assets/[0-9a-f]{16}/data/gestures/hello\.png$')
+
+    async def test_largest_raw_frame_fits_message_limit(self):
+        width, height = 1920, RAW_FRAME_MAX_PIXELS // 1920
+        frame = pack_frame(7, bytes(width * height * 3), codec=CODEC_BGR, width=width, height=height)
+        async with websockets.connect(self.url, max_size=None) as websocket:
+            await websocket.send(frame)
+            response = json.loads(await asyncio.wait_for(websocket.recv(), 60))
+        self.assertEqual(response, {"requestId": 7, "gesture": "", "size": width * height * 3})
+
+    async def test_raw_frame_over_pixel_limit_is_rejected(self):
+        width, height = 4096, RAW_FRAME_MAX_PIXELS // 4096 + 1
+        frame = pack_frame(7, bytes(width * height * 3), codec=CODEC_BGR, width=width, height=height)
+        async with websockets.connect(self.url, max_size=None) as websocket:
+            await websocket.send(frame)
+            response = json.loads(await asyncio.wait_for(websocket.recv(), 60))
+        self.assertEqual(response["status"], "error")
+        self.assertIn("pixels", response["message"])
+
+
+class AccessTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(auth, '_secret', b'test-secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = {
+            'admin@example.com': {'password': 'admin-hash', 'role': 'admin'},
+            'user@example.com': {'password': 'user-hash', 'role': 'user'},
+        }
+
+    def test_metrics_require_admin_token(self):
+        admin_token = auth.issue_token('admin@example.com', 'admin-hash')
+        self.assertTrue(server.is_admin({'type': 'metrics', 'token': admin_token}, self.users))
+        self.assertFalse(server.is_admin({'type': 'metrics'}, self.users))
+        self.assertFalse(server.is_admin(
+            {'type': 'metrics', 'token': auth.issue_token('user@example.com', 'user-hash')}, self.users))
+        # Токен, выданный до смены пароля, прав не даёт
+        self.users['admin@example.com']['password'] = 'new-hash'
+        self.assertFalse(server.is_admin({'type': 'metrics', 'token': admin_token}, self.users))
+
+    def test_register_ignores_requested_role(self):
+        with tempfile.TemporaryDirectory() as directory:
+            users = JsonCollection(os.path.join(directory, 'users.json'))
+            users.load()
+            response = asyncio.run(server.auth_user({
+                'action': 'register', 'email': 'mallory@example.com', 'password': 'secret', 'role': 'admin'}, users))
+            self.assertEqual(response['status'], 'success')
+            self.assertEqual(users['mallory@example.com']['role'], 'user')
+            self.assertFalse(server.is_admin({'type': 'metrics', 'token': response['token']}, users))
+
+    def test_default_users_are_seeded_into_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(storage, 'SQLITE_DATABASE', os.path.join(directory, 'data.sqlite3')), \
+                mock.patch.object(server, 'hash_password', lambda password: f"hash:{password}"):
+            store = DocumentStore({'users': os.path.join(directory, 'users.json')}, backend='sqlite')
+            store.load()
+            aggregates = UserAggregates()
+            server.seed_default_users(UserRegistry(AggregatedCollection(store['users'], aggregates)))
+            self.assertEqual(aggregates.users_count, 2)
+            asyncio.run(store.close())
+            self.assertFalse(os.path.exists(os.path.join(directory, 'users.json')))
+
+            store = DocumentStore({'users': os.path.join(directory, 'users.json')}, backend='sqlite')
+            store.load()
+            self.assertEqual(store['users']['admin@example.com']['role'], 'admin')
+            # Повторный запуск не перезаписывает существующих пользователей
+            server.seed_default_users(store['users'])
+            self.assertEqual(len(store['users']), 2)
+            asyncio.run(store.close())
+
+    def test_request_labels_are_bounded(self):
+        self.assertEqual(server.request_labels('gesture', 'create'), ('gesture', 'create'))
+        self.assertEqual(server.request_labels('auth', None), ('auth', ''))
+        self.assertEqual(server.request_labels('gesture', 'x' * 20), ('gesture', 'unknown'))
+        self.assertEqual(server.request_labels('note', ['get']), ('note', 'unknown'))
+        self.assertEqual(server.request_labels('nope', 'create'), ('invalid', ''))
+        self.assertEqual(server.request_labels(['gesture'], 'create'), ('invalid', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# server/test_server_logging.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import json
+import logging
+import unittest
+
+from server_logging import StructuredFormatter, summarize_request
+
+
+class SummarizeRequestTestCase(unittest.TestCase):
+    def test_nested_data_is_summarized(self):
+        summary = summarize_request({
+            "type": "user", "action": "update", "token": "secret",
+            "data": {"password": "secret", "photo": "A" * 500, "completedTests": [{"id": "1", "token": "t"}]},
+        })
+        self.assertEqual(summary["token"], "***")
+        self.assertEqual(summary["data"]["password"], "***")
+        self.assertRegex(summary["data"]["photo"], r"^<500 chars sha256:[0-9a-f]{12}>$")
+        self.assertEqual(summary["data"]["completedTests"], [{"id": "1", "token": "***"}])
+
+    def test_deep_nesting_is_cut(self):
+        request = {"data": {"a": {"b": {"c": {"d": 1}}}}, "frames": [""] * 64}
+        summary = summarize_request(request)
+        self.assertEqual(summary["data"]["a"]["b"]["c"], "<dict of 1>")
+        self.assertEqual(summary["frames"], "<list of 64>")
+
+    def test_fields_are_structured(self):
+        record = logging.LogRecord('server', logging.INFO, __file__, 1, "Login successful", None, None)
+        record.fields = {"user": "user@example.com", "role": "user"}
+        entry = json.loads(StructuredFormatter('json').format(record))
+        self.assertEqual(entry["msg"], "Login successful")
+        self.assertEqual(entry["user"], "user@example.com")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# server/test_storage.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import storage
+from storage import FlushError, JournaledCollection, JsonCollection, RevisionedCollection, WriteBehindWriter, load_json_file, save_json_file
+
+
+class WriteBehindWriterTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_file_does_not_drop_other_pending_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            missing = os.path.join(directory, 'missing')
+            paths = [os.path.join(directory, 'a.json'), os.path.join(missing, 'b.json'),
+                     os.path.join(directory, 'c.json')]
+            saved = []
+            writer = WriteBehindWriter(interval=60)
+            writer.start()
+            for path in paths:
+                writer.mark_dirty(path, {'path': path}, lambda path=path: saved.append(path))
+
+            with self.assertRaises(FlushError) as failed:
+                await writer.flush()
+            self.assertEqual(failed.exception.paths, [paths[1]])
+            self.assertEqual(saved, [paths[0], paths[2]])
+            self.assertEqual(writer.dirty_files, 1)
+
+            os.mkdir(missing)
+            await writer.close()
+            self.assertEqual(load_json_file(paths[1]), {'path': paths[1]})
+            self.assertEqual(writer.dirty_files, 0)
+
+
+class WriteFileAtomicTestCase(unittest.TestCase):
+    def test_keeps_mode_of_existing_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.json')
+            save_json_file(path, {})
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~storage._UMASK)
+            os.chmod(path, 0o640)
+            save_json_file(path, {'a': 1})
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+
+class JournaledCollectionTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'users.json')
+
+    def open(self):
+        collection = JournaledCollection(self.path, compact_records=1000)
+        collection.load()
+        return collection
+
+    def test_replay_after_crash_during_compaction(self):
+        collection = self.open()
+        collection.put('old', {'name': 'first'})
+        collection.compact()
+        collection.rename('old', 'new')
+        collection.put('old', {'name': 'second'})
+        collection.set_field('new', 'score', 1)
+        expected = dict(collection.items())
+
+        # Снимок записан, а .compacting не удалён - сбой между этими шагами
+        def write_snapshot_only(text):
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+        with mock.patch.object(collection, '_write_snapshot', write_snapshot_only):
+            collection.compact()
+        self.assertTrue(os.path.exists(collection.journal_path + '.compacting'))
+
+        self.assertEqual(dict(self.open().items()), expected)
+        self.assertEqual(dict(self.open().items()), expected)
+
+
+class RevisionedCollectionTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'gestures.json')
+        self.collection = self.open()
+
+    def open(self, max_tombstones=2):
+        collection = JsonCollection(self.path)
+        collection.load()
+        revisioned = RevisionedCollection(collection, self.path, max_tombstones=max_tombstones)
+        revisioned.load()
+        return revisioned
+
+    def sync(self, since=0, limit=None):
+        # Все страницы выгрузки: (документы, удалённые id, reset первой страницы)
+        docs, deleted, cursor, reset = self.collection.changes(since, limit)
+        pages = 1
+        while cursor is not None:
+            page_docs, page_deleted, cursor, page_reset = self.collection.changes(since, limit, cursor)
+            self.assertFalse(page_reset)
+            docs += page_docs
+            deleted += page_deleted
+            pages += 1
+            self.assertLess(pages, 100)
+        return docs, deleted, reset
+
+    def test_reset_snapshot_pages_past_horizon(self):
+        for key in '12345':
+            self.collection.put(key, {'id': key})
+        for key in '123':
+            self.collection.pop(key)
+        for key in '6789':
+            self.collection.put(key, {'id': key})
+        self.assertGreater(self.collection.horizon, 1)
+
+        docs, deleted, reset = self.sync(since=1, limit=2)
+        self.assertTrue(reset)
+        self.assertEqual([doc['id'] for doc in docs], ['4', '5', '6', '7', '8', '9'])
+
+    def test_snapshot_restarts_when_horizon_moves_past_it(self):
+        for key in '12345':
+            self.collection.put(key, {'id': key})
+        for key in '123':
+            self.collection.pop(key)
+        docs, _, cursor, reset = self.collection.changes(1, 1)
+        self.assertTrue(reset)
+        for key in '45':
+            self.collection.pop(key)
+        _, _, _, reset = self.collection.changes(1, 1, cursor)
+        self.assertTrue(reset)
+
+    def test_incremental_pages_include_deletions(self):
+        for key in '123':
+            self.collection.put(key, {'id': key})
+        revision = self.collection.revision
+        self.collection.put('4', {'id': '4'})
+        self.collection.pop('1')
+        self.collection.put('5', {'id': '5'})
+
+        docs, deleted, reset = self.sync(since=revision, limit=1)
+        self.assertFalse(reset)
+        self.assertEqual([doc['id'] for doc in docs], ['4', '5'])
+        self.assertEqual(deleted, ['1'])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.collection.changes(0, 1, 'x:1')
+
+    def test_documents_added_on_disk_get_revisions(self):
+        self.collection.put('1', {'id': '1'})
+        save_json_file(self.path, {'1': {'id': '1', '_rev': 1}, '2': {'id': '2'}})
+        self.collection.collection.load()
+
+        docs, _, _ = self.sync()
+        self.assertEqual([doc['id'] for doc in docs], ['1', '2'])
+        self.assertEqual(docs[1]['_rev'], self.collection.revision)
+
+    def test_startup_does_not_rewrite_documents_without_revisions(self):
+        save_json_file(self.path, {'1': {'id': '1'}, '2': {'id': '2'}})
+        with open(self.path, encoding='utf-8') as f:
+            before = f.read()
+        collection = self.open()
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), before)
+
+        docs, _, _, _ = collection.changes(0)
+        self.assertEqual([doc['_rev'] for doc in docs], [1, 2])
+        # Ревизии, выданные в памяти, попадают в файл со следующей записью и не повторяются после перезапуска
+        collection.put('3', {'id': '3'})
+        self.assertEqual({key: doc['_rev'] for key, doc in load_json_file(self.path).items()},
+                         {'1': 1, '2': 2, '3': 3})
+        self.assertEqual(self.open().revision, 3)
+
+    def test_changes_after_revision_do_not_read_older_documents(self):
+        for key in range(100):
+            self.collection.put(str(key), {'id': str(key)})
+        revision = self.collection.revision
+        self.collection.put('5', {'id': '5', 'name': 'changed'})
+        with mock.patch.object(self.collection.collection, 'get', wraps=self.collection.collection.get) as get:
+            docs, deleted, _, reset = self.collection.changes(revision)
+        self.assertEqual(([doc['id'] for doc in docs], deleted, reset), (['5'], [], False))
+        self.assertEqual(get.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
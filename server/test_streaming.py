@@ -0,0 +1,31 @@
+# server/test_streaming.py
+# Запуск из каталога server:
+#   python -m pytest -q
+import asyncio
+import unittest
+
+from streaming import FrameStream
+
+
+class FrameStreamTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_stream_continues_after_frame_error(self):
+        sent = []
+        stream = FrameStream(lambda response: asyncio.sleep(0, sent.append(response)))
+        self.addCleanup(stream.close)
+
+        async def fail():
+            raise RuntimeError("frame failed")
+
+        async def recognize():
+            return {"gesture": "ok"}
+
+        stream.push(fail)
+        await asyncio.sleep(0.01)
+        stream.push(recognize)
+        await asyncio.sleep(0.01)
+        self.assertEqual([response["gesture"] for response in sent], ["ok"])
+        self.assertEqual(stream.processed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
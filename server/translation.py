@@ -0,0 +1,150 @@
+# server/translation.py
+# Перевод текста конспектов с кэшем.
+#
+# Сетевой перевод выполняется в пуле потоков, event loop только ждёт результат (не дольше
+# TRANSLATION_TIMEOUT). Результаты кэшируются по (хэш текста, язык оригинала, язык перевода),
+# одинаковые одновременные запросы ждут один и тот же перевод.
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import load_json_file
+
+# Переводчик: 'google' (deep_translator) или 'stub' (локальная заглушка без сети)
+TRANSLATION_BACKEND = os.environ.get('TRANSLATION_BACKEND', 'google')
+TRANSLATION_CACHE_SIZE = int(os.environ.get('TRANSLATION_CACHE_SIZE', 1000))
+# Файл для сохранения кэша между перезапусками; пустое значение - кэш только в памяти
+TRANSLATION_CACHE_FILE = os.environ.get('TRANSLATION_CACHE_FILE', 'translations.json')
+TRANSLATION_TIMEOUT = float(os.environ.get('TRANSLATION_TIMEOUT', 10.0))
+TRANSLATION_WORKERS = int(os.environ.get('TRANSLATION_WORKERS', 4))
+# Языки, на которые конспекты переводятся заранее при создании/изменении
+NOTE_TRANSLATION_LANGUAGES = [lang for lang in os.environ.get('NOTE_TRANSLATION_LANGUAGES', 'uk,en').split(',') if lang]
+# Фоновый перевод никого не задерживает, поэтому ждёт дольше, чем запрос клиента
+NOTE_TRANSLATION_TIMEOUT = float(os.environ.get('NOTE_TRANSLATION_TIMEOUT', 60.0))
+# Переводимые поля конспекта
+NOTE_TRANSLATED_FIELDS = ('title', 'content')
+
+IMG_PATTERN = re.compile(r'\[img:(\d+)\]')
+
+
+class GoogleBackend:
+    def translate(self, text, src_lang, dest_lang):
+        # deep_translator нужен только этому бэкенду
+        from deep_translator import GoogleTranslator
+        return GoogleTranslator(source=src_lang, target=dest_lang).translate(text)
+
+
+class StubBackend:
+    # Без сети: помечает текст языком перевода, удобно для тестов и локальной разработки
+    def translate(self, text, src_lang, dest_lang):
+        return f'[{dest_lang}] {text}'
+
+
+BACKENDS = {
+    'google': GoogleBackend,
+    'stub': StubBackend,
+}
+
+
+class TranslationTimeout(Exception):
+    pass
+
+
+def translate_note_text(text, src_lang, dest_lang, backend):
+    # Найти все [img:N] и заменить на плейсхолдеры
+    placeholders = []
+    def repl(match):
+        placeholders.append(match.group(0))
+        return f'__IMG_{len(placeholders)-1}__'
+    temp_text = IMG_PATTERN.sub(repl, text)
+    # Перевести текст
+    translated = backend.translate(temp_text, src_lang, dest_lang)
+    # Вернуть плейсхолдеры обратно
+    for idx, ph in enumerate(placeholders):
+        translated = translated.replace(f'__IMG_{idx}__', ph)
+    return translated
+
+
+def cache_key(text, src_lang, dest_lang):
+    return f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}:{src_lang}:{dest_lang}"
+
+
+class NoteTranslator:
+    def __init__(self, backend=None, max_entries=TRANSLATION_CACHE_SIZE, path=TRANSLATION_CACHE_FILE,
+                 timeout=TRANSLATION_TIMEOUT, workers=TRANSLATION_WORKERS, writer=None):
+        self.backend = backend or BACKENDS[TRANSLATION_BACKEND]()
+        self.max_entries = max_entries
+        self.path = path
+        self.timeout = timeout
+        self.writer = writer
+        self.workers = workers
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._executor = None
+
+    def load(self):
+        if self.path:
+            self._cache.update(load_json_file(self.path))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    async def translate(self, text, src_lang, dest_lang, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        if not text.strip() or src_lang == dest_lang:
+            return text
+        key = cache_key(text, src_lang, dest_lang)
+        translated = self._cache.get(key)
+        if translated is not None:
+            self._cache.move_to_end(key)
+            return translated
+
+        future = self._in_flight.get(key)
+        if future is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='translate')
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, translate_note_text, text, src_lang, dest_lang, self.backend)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._finished(key, done))
+        try:
+            # По таймауту перевод не отменяется: когда он завершится, результат попадёт в кэш
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise TranslationTimeout(f"Translation timed out after {timeout:g}s")
+
+    def _finished(self, key, future):
+        self._in_flight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._cache[key] = future.result()
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        if self.path and self.writer is not None:
+            self.writer.mark_dirty(self.path, self._cache)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def translate_note(translator, note, languages=NOTE_TRANSLATION_LANGUAGES, timeout=NOTE_TRANSLATION_TIMEOUT):
+    # {язык: {поле: перевод}} для всех языков, кроме языка самого конспекта
+    src_lang = note.get('language', 'uk')
+    translations = {}
+    for dest_lang in languages:
+        if dest_lang == src_lang:
+            continue
+        translations[dest_lang] = {
+            field: await translator.translate(note.get(field) or '', src_lang, dest_lang, timeout)
+            for field in NOTE_TRANSLATED_FIELDS
+        }
+    return translations
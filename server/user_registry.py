@@ -0,0 +1,43 @@
+# server/user_registry.py
+import asyncio
+import contextlib
+import weakref
+
+
+class UserRegistry:
+    # Единый на процесс реестр пользователей поверх коллекции users.
+    # Соединения не держат своих копий: чтения идут в общую коллекцию, а изменения одного
+    # пользователя выполняются под его блокировкой, чтобы запросы с ожиданием внутри
+    # (проверка пароля в пуле потоков и т.п.) не перемешивали изменения разных соединений
+    def __init__(self, collection):
+        self.collection = collection
+        # Блокировка живёт, пока её кто-то держит или ждёт
+        self._locks = weakref.WeakValueDictionary()
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __contains__(self, key):
+        return key in self.collection
+
+    def __len__(self):
+        return len(self.collection)
+
+    def __getitem__(self, key):
+        return self.collection[key]
+
+    def _lock(self, username):
+        lock = self._locks.get(username)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[username] = lock
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def lock(self, *usernames):
+        # Несколько пользователей (переименование) блокируются в одном порядке - без взаимных блокировок
+        locks = [self._lock(username) for username in sorted({name for name in usernames if name})]
+        async with contextlib.AsyncExitStack() as stack:
+            for lock in locks:
+                await stack.enter_async_context(lock)
+            yield